@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+import metrics
+
+# Concurrent generations per model; match the daemon's OLLAMA_NUM_PARALLEL
+MODEL_CONCURRENCY = int(os.environ.get("OLLAMA_STUDIES_MODEL_CONCURRENCY", "1"))
+
+# Requests that may wait for a model before new ones are turned away
+MAX_QUEUE = int(os.environ.get("OLLAMA_STUDIES_MAX_QUEUE", "16"))
+
+# Requests a single session may have waiting at once
+MAX_QUEUED_PER_SESSION = 2
+
+# Used for Retry-After until a model has served a request
+DEFAULT_SERVICE_TIME = 5.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when a model's queue is full; retry_after is a suggested wait in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A request's place in a model's queue."""
+
+    def __init__(self, model, session_id):
+        self.model = model
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+
+    @property
+    def granted(self):
+        return self.granted_at is not None
+
+    @property
+    def wait_time(self):
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+
+class _ModelQueue:
+    def __init__(self):
+        self.active = 0
+        # Waiting tickets per session, served round-robin so one session can't starve the others
+        self.sessions = OrderedDict()
+        self.waiting = 0
+        self.service_time = None
+
+    def order(self):
+        """Waiting tickets in the order they will be admitted."""
+        queues = [list(tickets) for tickets in self.sessions.values()]
+        ordered = []
+        for i in range(max((len(tickets) for tickets in queues), default=0)):
+            ordered.extend(tickets[i] for tickets in queues if i < len(tickets))
+        return ordered
+
+    def pop_next(self):
+        session_id, tickets = next(iter(self.sessions.items()))
+        ticket = tickets.popleft()
+        del self.sessions[session_id]
+        if tickets:
+            self.sessions[session_id] = tickets
+        self.waiting -= 1
+        return ticket
+
+
+class AdmissionController:
+    """Limits concurrent generations per model and queues the rest.
+
+    Each model admits up to `concurrency` requests at a time. Further
+    requests wait in a bounded queue that takes turns between sessions;
+    once the queue is full, new requests are rejected straight away with
+    AdmissionRejected instead of piling up behind the model.
+    """
+
+    def __init__(self, concurrency=MODEL_CONCURRENCY, max_queue=MAX_QUEUE,
+                 max_queued_per_session=MAX_QUEUED_PER_SESSION):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_queued_per_session = max_queued_per_session
+        self._condition = threading.Condition()
+        self._models = {}
+
+    def _queue(self, model):
+        queue = self._models.get(model)
+        if queue is None:
+            queue = self._models[model] = _ModelQueue()
+        return queue
+
+    def _retry_after(self, queue):
+        service_time = queue.service_time or DEFAULT_SERVICE_TIME
+        return max(1, int(round(service_time * (queue.waiting + 1) / self.concurrency)))
+
+    def _update_gauges(self, model, queue):
+        metrics.admission_queue_depth.set(queue.waiting, model=model)
+        metrics.admission_active.set(queue.active, model=model)
+
+    def _admit_waiting(self, model, queue):
+        while queue.waiting and queue.active < self.concurrency:
+            ticket = queue.pop_next()
+            ticket.granted_at = time.monotonic()
+            queue.active += 1
+            metrics.admission_wait.observe(ticket.wait_time, model=model)
+        self._update_gauges(model, queue)
+        self._condition.notify_all()
+
+    def enqueue(self, model, session_id):
+        """Join the model's queue; raises AdmissionRejected if there is no room."""
+        with self._condition:
+            queue = self._queue(model)
+            session_tickets = queue.sessions.get(session_id)
+            if queue.waiting >= self.max_queue or (
+                    session_tickets is not None and len(session_tickets) >= self.max_queued_per_session):
+                metrics.admission_rejected.inc(model=model)
+                raise AdmissionRejected(f"Too many requests waiting for {model}", self._retry_after(queue))
+            ticket = Ticket(model, session_id)
+            queue.sessions.setdefault(session_id, deque()).append(ticket)
+            queue.waiting += 1
+            self._admit_waiting(model, queue)
+            return ticket
+
+    def wait(self, ticket, timeout=None):
+        """Wait until the ticket is admitted; returns whether it was."""
+        with self._condition:
+            return self._condition.wait_for(lambda: ticket.granted, timeout)
+
+    def position(self, ticket):
+        """The ticket's 1-based place in the queue, or 0 once it is admitted."""
+        with self._condition:
+            if ticket.granted:
+                return 0
+            return self._queue(ticket.model).order().index(ticket) + 1
+
+    def release(self, ticket):
+        """Give up the ticket's slot, or its place in the queue if it was never admitted."""
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            queue = self._queue(ticket.model)
+            if ticket.granted:
+                queue.active -= 1
+                service_time = time.monotonic() - ticket.granted_at
+                # Smoothed generation time, for Retry-After estimates
+                queue.service_time = service_time if queue.service_time is None \
+                    else 0.8 * queue.service_time + 0.2 * service_time
+            else:
+                tickets = queue.sessions[ticket.session_id]
+                tickets.remove(ticket)
+                if not tickets:
+                    del queue.sessions[ticket.session_id]
+                queue.waiting -= 1
+            self._admit_waiting(ticket.model, queue)
@@ -3,20 +3,43 @@
 import os
 import json
 import time
+import hashlib
+import threading
 import subprocess
-from datetime import datetime
-import ollama
+import uuid
+from collections import OrderedDict
 from rich.console import Console
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from markupsafe import Markup
+from flask import Flask, render_template, make_response, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, g
+from markupsafe import Markup, escape
 from flask_wtf import CSRFProtect
 from flask_wtf.file import FileField
 from wtforms import StringField, TextAreaField, SelectField, FloatField, IntegerField, SubmitField, validators
 from flask_wtf import FlaskForm
+from conversation_store import create_conversation_store
+from model_registry import registry
+from backend_pool import pool
+from response_cache import response_cache, replay
+from history_window import with_token_count, assemble_prompt, prompt_tokens, strip_message
+from jobs import JobRunner, JobQueueFull
+from conversation_archive import ConversationArchive
+from conversation_search import ConversationSearchIndex, SNIPPET_START, SNIPPET_END
+import metrics
+from retrieval import build_context_message, EMBEDDING_MODEL
+from ingestion import Ingestion, UPLOAD_DIRECTORY, upload_format, save_upload
+from model_residency import ModelResidency
+from admission import AdmissionController, AdmissionRejected
+from semantic_cache import semantic_cache, BYPASS_HEADER
+from ollama_probe import probe
+from compaction import ConversationCompactor
+from profiler import profiler
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # For flash messages and sessions
+# For flash messages and sessions. Without a configured key every session, and the
+# conversation it points to in the store, is lost when the app restarts.
+app.secret_key = os.environ.get("OLLAMA_STUDIES_SECRET_KEY") or os.urandom(24)
+# Largest request accepted, which bounds the size of training file uploads
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("OLLAMA_STUDIES_MAX_UPLOAD_MB", "1024")) * 1024 * 1024
 csrf = CSRFProtect(app)
 
 # Add simple HTML conversion filter for Jinja templates
@@ -34,6 +57,40 @@ def render_markdown(text):
         text = ''.join(parts)
     return Markup(text)
 
+# Rendered messages that weren't stored with their HTML, e.g. from the archive, keyed by content hash
+RENDER_CACHE_SIZE = 1024
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+def cached_markdown(content):
+    """render_markdown() memoized by a hash of the content."""
+    key = hashlib.sha1(content.encode('utf-8')).digest()
+    with _rendered_lock:
+        html = _rendered.get(key)
+        if html is not None:
+            _rendered.move_to_end(key)
+            return html
+    html = render_markdown(content)
+    with _rendered_lock:
+        _rendered[key] = html
+        while len(_rendered) > RENDER_CACHE_SIZE:
+            _rendered.popitem(last=False)
+    return html
+
+def with_html(message):
+    """Return an assistant message with its rendered HTML stored under 'html'."""
+    if message.get('role') == 'assistant' and 'html' not in message:
+        message = dict(message)
+        message['html'] = str(render_markdown(message['content']))
+    return message
+
+@app.template_filter('message_html')
+def message_html(message):
+    """The HTML of an assistant message, rendered when it was stored or else once per distinct content."""
+    if 'html' in message:
+        return Markup(message['html'])
+    return cached_markdown(message['content'])
+
 
 # Initialize console for CLI output capture
 console = Console()
@@ -67,6 +124,38 @@ DEFAULT_MODEL = "tinyllama"
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_CONTEXT_LENGTH = 2048
 
+# Server-side conversation store; the cookie session only carries an opaque id
+CONVERSATION_STORE = os.environ.get("OLLAMA_STUDIES_CONVERSATION_STORE", "conversations/store.db")
+# Days a conversation may sit idle before it is deleted from the store; 0 keeps it forever
+CONVERSATION_TTL_DAYS = float(os.environ.get("OLLAMA_STUDIES_CONVERSATION_TTL_DAYS", "30"))
+conversation_store = create_conversation_store(CONVERSATION_STORE, CONVERSATION_TTL_DAYS * 86400 or None)
+
+# Saved conversations
+conversation_archive = ConversationArchive(search_index=ConversationSearchIndex())
+
+# Background workers for model pulls, so a multi-GB download doesn't hold a request
+pull_jobs = JobRunner(workers=2, max_queue=16)
+
+# Model creation is queued; concurrent creates against one daemon only contend with each other
+CREATE_CONCURRENCY = int(os.environ.get("OLLAMA_STUDIES_CREATE_CONCURRENCY", "1"))
+create_jobs = JobRunner(workers=CREATE_CONCURRENCY, max_queue=16)
+
+# Keeps the models in use loaded in Ollama, and lets idle custom models go
+residency = ModelResidency(MODEL_OPTIONS)
+
+# Summarizes the oldest turns of long conversations in the background
+compactor = ConversationCompactor()
+
+# Per-model concurrency limit and queue in front of the chat routes
+admission = AdmissionController()
+# How long a queued chat request waits for its model before giving up
+QUEUE_TIMEOUT = 120
+
+# Set in the WSGI environ by asgi.py, which streams chat replies itself; the
+# chat stream view then hands its StreamingChat over under STREAMING_CHAT_KEY
+ASYNC_STREAM_KEY = 'ollama_studies.async_stream'
+STREAMING_CHAT_KEY = 'ollama_studies.streaming_chat'
+
 # Forms
 class ConversationSettingsForm(FlaskForm):
     model = SelectField('Model', choices=[(k, v['description']) for k, v in MODEL_OPTIONS.items()])
@@ -85,33 +174,32 @@ class MessageForm(FlaskForm):
     submit = SubmitField('Send')
 
 class TrainingForm(FlaskForm):
-    training_text = TextAreaField('Paste text for training', validators=[validators.DataRequired()])
+    training_text = TextAreaField('Paste text for training')
+    training_file = FileField('Or upload a file (.txt, .md or .jsonl, optionally gzipped)')
     model_name = StringField('New model name (no spaces)', validators=[validators.DataRequired()])
     base_model = SelectField('Base Model', choices=[(k, v['description']) for k, v in MODEL_OPTIONS.items()])
     submit = SubmitField('Train Model')
+    
+    def validate_training_text(self, field):
+        if not (field.data or '').strip() and not self.training_file.data:
+            raise validators.ValidationError("Paste some text or upload a file to train on.")
+    
+    def validate_training_file(self, field):
+        if field.data:
+            try:
+                upload_format(field.data.filename)
+            except ValueError as e:
+                raise validators.ValidationError(str(e))
 
 # Helper functions
 def check_ollama_installed():
-    """Check if Ollama is installed on the system."""
-    try:
-        result = subprocess.run(['which', 'ollama'], 
-                            stdout=subprocess.PIPE, 
-                            stderr=subprocess.PIPE, 
-                            text=True)
-        return result.returncode == 0
-    except:
-        return False
+    """Check if Ollama is installed on the system, or its daemon is reachable."""
+    return probe.is_installed()
 
 def check_model_exists(model_name):
     """Check if the specified model is already pulled."""
     try:
-        models = ollama.list()
-        for model in models['models']:
-            # Try different possible keys for model name
-            if ('name' in model and model['name'] == model_name) or\
-               ('model' in model and model['model'] == model_name):
-                return True
-        return False
+        return registry.exists(model_name)
     except Exception as e:
         print(f"Error checking if model exists: {e}")
         return False
@@ -119,108 +207,307 @@ def check_model_exists(model_name):
 def get_available_models():
     """Get a list of all available models, including custom ones."""
     try:
-        # Get the list of models and print the structure to debug
-        models_response = ollama.list()
-        
-        # Check the structure of the response and extract model names
-        if 'models' in models_response and isinstance(models_response['models'], list):
-            # First try to access each model with the expected structure
-            model_names = []
-            for model in models_response['models']:
-                # Print the model structure for debugging
-                print(f"Model structure: {model}")
-                # Check which key contains the model name
-                if 'name' in model:
-                    model_names.append(model['name'])
-                elif 'model' in model:
-                    model_names.append(model['model'])
-            return model_names
-        else:
-            print(f"Unexpected API response structure: {models_response}")
-            return []
+        return registry.names()
     except Exception as e:
         print(f"Error getting models: {e}")
         return []
 
-def pull_model(model_name):
-    """Pull the specified model."""
-    try:
-        # Non-streaming version for the web interface
-        ollama.pull(model_name)
-        return True
-    except Exception as e:
-        return False
+def pull_model(job, model_name):
+    """Pull the specified model, recording download progress on the job."""
+    # Progress is reported per layer, so keep the latest numbers for each digest
+    layers = {}
+    for progress in pool.pull(model_name, stream=True):
+        job.check_cancelled()
+        if 'digest' in progress and progress['digest'] and 'total' in progress and progress['total']:
+            layers[progress['digest']] = (progress.get('completed') or 0, progress['total'])
+        job.update(
+            message=progress.get('status', ''),
+            completed=sum(completed for completed, total in layers.values()),
+            total=sum(total for completed, total in layers.values())
+        )
+    registry.invalidate()
+    return True
 
 def save_conversation(conversation_history):
-    """Save the conversation history to a file."""
+    """Save the session's conversation to the archive, appending only new turns."""
     if not conversation_history:
         return None
     
-    # Create conversations directory if it doesn't exist
-    os.makedirs("conversations", exist_ok=True)
+    conversation_id, archived_turns = conversation_archive.save(
+        [strip_message(message) for message in conversation_history],
+        model=session.get('model', DEFAULT_MODEL),
+        conversation_id=session.get('archive_id'),
+        archived_turns=session.get('archived_turns', 0)
+    )
+    session['archive_id'] = conversation_id
+    session['archived_turns'] = archived_turns
+    
+    return conversation_id
+
+def run_ollama_create(job, new_model_name, modelfile_path):
+    """Run `ollama create`, stopping it if the job is cancelled."""
+    # Use a direct system command to create the model
+    # This bypasses potential issues with the Python library
+    process = subprocess.Popen(
+        ["ollama", "create", new_model_name, "-f", modelfile_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if job.cancel_requested.is_set():
+                process.terminate()
+                process.communicate()
+                job.check_cancelled()
+    
+    if process.returncode != 0:
+        raise RuntimeError(stderr.strip() or f"ollama create exited with status {process.returncode}")
+
+def train_model_on_upload(job, upload_path, filename, new_model_name, base_model):
+    """Train a model on an uploaded file, or pasted text saved as one, deleting it once it is ingested."""
+    try:
+        return train_model_on_file(job, upload_path, filename, new_model_name, base_model)
+    finally:
+        try:
+            os.remove(upload_path)
+        except OSError:
+            pass
+
+def train_model_on_file(job, upload_path, filename, new_model_name, base_model):
+    """Train a model on the text content of a file."""
+    # Create necessary directories
+    os.makedirs("training_data", exist_ok=True)
+    
+    # Two-step approach: first create a basic model, then add knowledge with prompts
+    
+    # Step 1: Create a basic Modelfile
+    job.update(message="Writing Modelfile")
+    modelfile_path = os.path.abspath(f"training_data/{new_model_name}.modelfile")
+    with open(modelfile_path, 'w') as f:
+        f.write(f"FROM {base_model}\n")
+        # Keep the system prompt simple
+        f.write(f"SYSTEM You are an AI assistant that specializes in the information provided in your training.\n")
+    
+    job.update(message=f"Creating model {new_model_name} from {base_model}")
+    run_ollama_create(job, new_model_name, modelfile_path)
+    
+    # The new model must show up in the next listing
+    registry.invalidate()
+    
+    # Step 2: Save the training content and index it so relevant chunks can be retrieved at chat time
+    if not check_model_exists(EMBEDDING_MODEL) and not check_model_exists(f"{EMBEDDING_MODEL}:latest"):
+        job.update(message=f"Pulling embedding model {EMBEDDING_MODEL}")
+        pool.pull(EMBEDDING_MODEL)
+        registry.invalidate()
+    
+    def ingestion_progress(ingestion):
+        job.check_cancelled()
+        job.update(message=f"Ingesting training content: {ingestion.bytes_read / 1024 ** 2:.1f} of "
+                           f"{ingestion.size / 1024 ** 2:.1f} MB at {ingestion.mb_per_second:.1f} MB/s, "
+                           f"{ingestion.chunks} chunks",
+                   completed=ingestion.bytes_read, total=ingestion.size)
+    
+    training_file_path = os.path.abspath(f"training_data/{new_model_name}_content.txt")
+    ingestion = Ingestion(upload_path, filename, ingestion_progress)
+    summary = ingestion.run(new_model_name, training_file_path)
+    job.update(message=summary, completed=ingestion.size, total=ingestion.size)
+    
+    # Verify that the model was created successfully by checking if it exists
+    if check_model_exists(new_model_name):
+        # Output detailed success message with next steps
+        return f"Model '{new_model_name}' created successfully! {summary}. The training content has been saved and you can now chat with this model to access information from your training content. You'll find this model in the model selection dropdown on the settings page."
+    else:
+        # Model creation command succeeded but model isn't detected yet - might need time to register
+        return f"Model '{new_model_name}' was created but may take a moment to become available. {summary}. Check the Settings page in a few seconds to see it in the model dropdown."
+
+def get_session_id():
+    """Return the opaque id of the current browser session, creating it if needed."""
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    return session['session_id']
+
+def get_conversation_history():
+    """Load the conversation history of the current session from the store."""
+    return conversation_store.get_history(get_session_id())
+
+def new_message(role, content):
+    """Build a message as it is stored, with its token count and HTML."""
+    return with_html(with_token_count({"role": role, "content": content}))
+
+def append_message(role, content):
+    """Append a single message to the current session's conversation."""
+    message = new_message(role, content)
+    conversation_store.append(get_session_id(), message)
+    return message
+
+def get_chat_options():
+    """Build the Ollama options for the current session.
+    
+    num_thread and num_batch come from the model's fastest profiled option
+    set on this machine, if `main.py profile` has measured it.
+    """
+    options = profiler.best_options(session.get('model', DEFAULT_MODEL))
+    options.pop('num_ctx', None)
+    options.update({
+        "temperature": session.get('temperature', DEFAULT_TEMPERATURE),
+        "num_ctx": session.get('context_length', DEFAULT_CONTEXT_LENGTH)
+    })
+    return options
+
+def get_chat_messages(conversation_history):
+    """Build the messages for the next reply.
     
-    # Generate filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"conversations/conversation_{timestamp}.json"
+    The system prompt leads, followed by the history windowed to what fits in
+    the session's context length. For models trained on text, the training
+    chunks most relevant to the latest message go right before it.
+    """
+    system_prompt = session.get('system_prompt', "You are a helpful AI assistant.")
+    summary_message, recent_history = compactor.compacted(get_session_id(), conversation_history)
     
-    with open(filename, 'w') as file:
-        json.dump(conversation_history, file, indent=2)
+    context_message = None
+    if conversation_history and conversation_history[-1]['role'] == 'user':
+        try:
+            context_message = build_context_message(session.get('model', DEFAULT_MODEL),
+                                                    conversation_history[-1]['content'])
+        except Exception as e:
+            print(f"Error retrieving training content: {e}")
     
-    return filename
+    return assemble_prompt(recent_history, session.get('context_length', DEFAULT_CONTEXT_LENGTH),
+                           system_prompt, context_message, summary_message)
 
-def train_model_on_text(text_content, new_model_name, base_model):
-    """Train a model on the provided text content."""
+def compact_conversation(session_id, conversation_history, num_ctx, system_prompt):
+    """Fold the oldest turns into the conversation's summary in the background, once it grows long."""
     try:
-        # Create necessary directories
-        os.makedirs("training_data", exist_ok=True)
-        
-        # Two-step approach: first create a basic model, then add knowledge with prompts
-        
-        # Step 1: Create a basic Modelfile
-        modelfile_path = os.path.abspath(f"training_data/{new_model_name}.modelfile")
-        with open(modelfile_path, 'w') as f:
-            f.write(f"FROM {base_model}\n")
-            # Keep the system prompt simple
-            f.write(f"SYSTEM You are an AI assistant that specializes in the information provided in your training.\n")
-        
-        # Use a direct system command to create the model
-        # This bypasses potential issues with the Python library
-        # Execute ollama create with the modelfile
-        import subprocess
-        result = subprocess.run(
-            ["ollama", "create", new_model_name, "-f", modelfile_path],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            return False, result.stderr
-        
-        # Step 2: Save the training content to embed with the model
-        training_file_path = os.path.abspath(f"training_data/{new_model_name}_content.txt")
-        with open(training_file_path, 'w') as f:
-            f.write(text_content)
-            
-        # Create a conversation file that will embed the training content
-        conversation_file = os.path.abspath(f"training_data/{new_model_name}_conversation.json")
-        with open(conversation_file, 'w') as f:
-            # Format: Create a chat history that includes the training content as context
-            convo = [
-                {"role": "system", "content": f"You are an AI assistant trained on specific documentation. Use this information as your primary knowledge source: {text_content}"},
-                {"role": "user", "content": "Please confirm you have access to the information I provided."},
-                {"role": "assistant", "content": "Yes, I have access to the information you provided. I can answer questions about this content and use it as my knowledge base."}
-            ]
-            json.dump(convo, f, indent=2)
-            
-        # Verify that the model was created successfully by checking if it exists
-        if check_model_exists(new_model_name):
-            # Output detailed success message with next steps
-            return True, f"Model '{new_model_name}' created successfully! The training content has been saved and you can now chat with this model to access information from your training content. You'll find this model in the model selection dropdown on the settings page."
-        else:
-            # Model creation command succeeded but model isn't detected yet - might need time to register
-            return True, f"Model '{new_model_name}' was created but may take a moment to become available. Check the Settings page in a few seconds to see it in the model dropdown."
+        compactor.maybe_compact(session_id, conversation_history, num_ctx, system_prompt)
+    except Exception as e:
+        print(f"Error compacting conversation: {e}")
+
+def find_job(job_id):
+    """Look up a background job across all job runners."""
+    return pull_jobs.get(job_id) or create_jobs.get(job_id)
+
+class StreamingChat:
+    """The reply to a streamed chat message, from its place in the queue to the stored answer.
+    
+    Each step returns the Server-Sent Event to send, if any. events() runs the
+    steps on the request thread; asgi.py runs the same steps on its event loop.
+    """
+    
+    def __init__(self, session_id, model_name, messages, options, ticket, lookup, started, conversation_history):
+        self.session_id = session_id
+        self.model_name = model_name
+        self.messages = messages
+        self.options = options
+        self.ticket = ticket
+        self.lookup = lookup
+        self.started = started
+        # Stored so far, plus the new message, which is only stored along with the reply. The count of
+        # stored messages is sent along so the page can sync later turns.
+        self.conversation_history = conversation_history
+        self.history_length = len(conversation_history)
+        self.system_prompt = session.get('system_prompt', "You are a helpful AI assistant.")
+        self.route = request.url_rule.rule
+        self.method = request.method
+        self.response_text = ""
+        self.ttft = None
+        self.chat_started = None
+    
+    def queued_event(self):
+        if self.ticket.wait_time > QUEUE_TIMEOUT:
+            raise TimeoutError(f"Timed out waiting for {self.model_name}")
+        return sse_event('queued', {'position': admission.position(self.ticket)})
+    
+    def start(self):
+        """Return the arguments of the chat call, once the model is free."""
+        self.chat_started = time.perf_counter()
+        residency.touch(self.model_name)
+        return {'model': self.model_name, 'messages': self.messages, 'options': self.options,
+                'keep_alive': residency.keep_alive_for(self.model_name)}
+    
+    def on_chunk(self, chunk):
+        if chunk.get('done'):
+            metrics.observe_response(self.model_name, chunk, self.ttft, prompt_tokens(self.messages))
+        if 'message' in chunk and 'content' in chunk['message']:
+            content_chunk = chunk['message']['content']
+            if self.ttft is None and content_chunk:
+                self.ttft = time.perf_counter() - self.chat_started
+            self.response_text += content_chunk
+            return sse_event('token', {'content': content_chunk})
+        return None
+    
+    def fail(self, error):
+        self.observe(500)
+        return sse_event('error', {'error': str(error), 'count': self.history_length - 1})
+    
+    def finish(self):
+        # A failed or abandoned reply leaves no unanswered user message behind
+        conversation_store.append(self.session_id, self.conversation_history[-1])
+        message = new_message("assistant", self.response_text)
+        conversation_store.append(self.session_id, message)
+        semantic_cache.add(self.model_name, self.lookup, self.response_text, self.system_prompt)
+        compact_conversation(self.session_id, self.conversation_history + [message], self.options.get('num_ctx'),
+                             self.system_prompt)
+        self.observe(200)
+        return sse_event('done', {'html': message['html'], 'count': self.history_length + 1})
+    
+    def release(self):
+        admission.release(self.ticket)
+    
+    def observe(self, status):
+        metrics.request_duration.observe(time.perf_counter() - self.started,
+                                         route=self.route, method=self.method, status=status)
+    
+    def events(self):
+        try:
+            # Report the queue position until the model is free
+            while not admission.wait(self.ticket, 1.0):
+                yield self.queued_event()
+            for chunk in response_cache.chat(stream=True, **self.start()):
+                event = self.on_chunk(chunk)
+                if event is not None:
+                    yield event
+        except Exception as e:
+            yield self.fail(e)
+            return
+        finally:
+            self.release()
+        yield self.finish()
+
+def lookup_similar_answer(model_name, conversation_history, question):
+    """Look for an answer to a similar question, unless the client asked for a fresh one."""
+    if request.headers.get(BYPASS_HEADER, '').lower() == 'bypass':
+        return None
+    try:
+        return semantic_cache.lookup(model_name, conversation_history, question,
+                                     session.get('system_prompt', "You are a helpful AI assistant."))
     except Exception as e:
-        return False, str(e)
+        print(f"Error looking up similar questions: {e}")
+        return None
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def observe_request(started, status):
+    """Record the wall-clock duration of the current request."""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.request_duration.observe(time.perf_counter() - started,
+                                     route=route, method=request.method, status=status)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    # Streamed responses are timed when their generator finishes
+    if not response.is_streamed and 'request_started' in g:
+        observe_request(g.request_started, response.status_code)
+    return response
 
 # Routes
 @app.route('/')
@@ -239,8 +526,30 @@ def check_model(model_name):
 
 @app.route('/pull_model/<model_name>')
 def pull_model_route(model_name):
-    success = pull_model(model_name)
-    return jsonify({'success': success})
+    try:
+        job = pull_jobs.submit('pull', model_name, pull_model, model_name)
+    except JobQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+    return jsonify({'success': True, 'job_id': job.id})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    cancelled = pull_jobs.cancel(job_id) or create_jobs.cancel(job_id)
+    if job.kind == 'create':
+        if cancelled:
+            flash(f"Cancelling training of {job.key}", "warning")
+        return redirect(url_for('train_status', job_id=job_id))
+    return jsonify({'cancelled': cancelled})
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -262,10 +571,20 @@ def settings():
                 'context_length': 2048  # Default context length
             }
     
-    # Update form choices
-    form.model.choices = [(model, combined_model_options[model]['name']) 
-                         for model in combined_model_options 
-                         if model in available_models]
+    # Update form choices, with the throughput measured on this machine
+    form.model.choices = []
+    for model in combined_model_options:
+        if model in available_models:
+            throughput = profiler.throughput(model)
+            label = combined_model_options[model]['name']
+            form.model.choices.append((model, f"{label} ({throughput:.1f} tokens/s)" if throughput else label))
+    
+    # Default to the fastest profiled model, with the context length it was fastest at
+    if not form.is_submitted():
+        fastest = profiler.fastest([model for model, _ in form.model.choices])
+        if fastest is not None:
+            form.model.data = fastest
+            form.context_length.data = profiler.best_options(fastest).get('num_ctx', DEFAULT_CONTEXT_LENGTH)
     
     if form.validate_on_submit():
         # Store settings in session
@@ -275,7 +594,13 @@ def settings():
         session['system_prompt'] = form.system_prompt.data
         
         # Initialize conversation history
-        session['conversation_history'] = []
+        conversation_store.clear(get_session_id())
+        compactor.forget(get_session_id())
+        session.pop('archive_id', None)
+        session.pop('archived_turns', None)
+        
+        # Start loading the model now so the first message doesn't wait for it
+        residency.preload(form.model.data)
         
         return redirect(url_for('chat'))
     
@@ -285,59 +610,197 @@ def settings():
 def chat():
     form = MessageForm()
     
-    # Get conversation history from session
-    conversation_history = session.get('conversation_history', [])
+    # Get conversation history from the store
+    conversation_history = get_conversation_history()
     
     if form.validate_on_submit():
         user_message = form.message.data
+        model_name = session.get('model', DEFAULT_MODEL)
+        
+        # A question that was already answered in other words needs no generation
+        lookup = lookup_similar_answer(model_name, conversation_history, user_message)
+        if lookup is not None and lookup.answer is not None:
+            conversation_history.append(append_message("user", user_message))
+            conversation_history.append(append_message("assistant", lookup.answer))
+            form.message.data = ""
+            return render_template('chat.html', form=form, conversation_history=conversation_history)
         
-        # Add user message to history
-        conversation_history.append({"role": "user", "content": user_message})
+        # Wait for a turn on the model, or turn the request away if its queue is full
+        try:
+            ticket = admission.enqueue(model_name, get_session_id())
+        except AdmissionRejected as e:
+            flash(f"{model_name} is busy. Please try again in {e.retry_after} seconds.", "error")
+            response = make_response(render_template('chat.html', form=form, conversation_history=conversation_history), 429)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
         
-        # Get response from model
+        # Get response from model. The user message is only stored along with the reply,
+        # so a failed request leaves no unanswered turn behind.
+        user_turn = new_message("user", user_message)
         try:
-            response = ollama.chat(
-                model=session.get('model', DEFAULT_MODEL),
-                messages=conversation_history,
-                options={
-                    "temperature": session.get('temperature', DEFAULT_TEMPERATURE),
-                    "num_ctx": session.get('context_length', DEFAULT_CONTEXT_LENGTH),
-                    "system": session.get('system_prompt', "You are a helpful AI assistant.")
-                }
+            conversation_history.append(user_turn)
+            
+            if not admission.wait(ticket, QUEUE_TIMEOUT):
+                raise TimeoutError(f"Timed out waiting for {model_name}")
+            residency.touch(model_name)
+            messages = get_chat_messages(conversation_history)
+            response = response_cache.chat(
+                model=model_name,
+                messages=messages,
+                options=get_chat_options(),
+                keep_alive=residency.keep_alive_for(model_name)
             )
+            metrics.observe_response(model_name, response, prompt_tokens=prompt_tokens(messages))
             
-            # Add assistant response to history
+            # Add the user message and the assistant response to history
             if 'message' in response and 'content' in response['message']:
-                conversation_history.append({"role": "assistant", "content": response['message']['content']})
+                conversation_store.append(get_session_id(), user_turn)
+                conversation_history.append(append_message("assistant", response['message']['content']))
+                semantic_cache.add(model_name, lookup, response['message']['content'],
+                                   session.get('system_prompt', "You are a helpful AI assistant."))
+                compact_conversation(get_session_id(), conversation_history,
+                                     session.get('context_length', DEFAULT_CONTEXT_LENGTH),
+                                     session.get('system_prompt', "You are a helpful AI assistant."))
         
         except Exception as e:
             flash(f"Error: {str(e)}", "error")
+        finally:
+            admission.release(ticket)
         
-        # Update session
-        session['conversation_history'] = conversation_history
-        
-        # Clear form
-        form.message.data = ""
+        if conversation_history and conversation_history[-1] is user_turn:
+            # Not stored, so not shown either; the message stays in the form to be sent again
+            conversation_history.pop()
+        else:
+            # Clear form
+            form.message.data = ""
     
     return render_template('chat.html', form=form, conversation_history=conversation_history)
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the model's reply to a new message as Server-Sent Events."""
+    form = MessageForm()
+    if not form.validate_on_submit():
+        return jsonify({'error': 'Invalid message'}), 400
+    
+    session_id = get_session_id()
+    model_name = session.get('model', DEFAULT_MODEL)
+    conversation_history = get_conversation_history()
+    started = g.request_started
+    
+    lookup = lookup_similar_answer(model_name, conversation_history, form.message.data)
+    if lookup is not None and lookup.answer is not None:
+        append_message("user", form.message.data)
+        answer = append_message("assistant", lookup.answer)
+        
+        def replay_answer():
+            for chunk in replay(model_name, lookup.answer):
+                if chunk['message']['content']:
+                    yield sse_event('token', {'content': chunk['message']['content']})
+            yield sse_event('done', {'html': answer['html'], 'count': len(conversation_history) + 2})
+            observe_request(started, 200)
+        
+        return Response(stream_with_context(replay_answer()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    try:
+        ticket = admission.enqueue(model_name, session_id)
+    except AdmissionRejected as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    # Until the stream owns the ticket, give it back if anything fails
+    try:
+        # Stored by StreamingChat.finish along with the reply
+        conversation_history.append(new_message("user", form.message.data))
+        
+        chat = StreamingChat(session_id, model_name, get_chat_messages(conversation_history), get_chat_options(),
+                             ticket, lookup, started, conversation_history)
+        
+        if request.environ.get(ASYNC_STREAM_KEY):
+            # asgi.py streams the reply on its event loop once this view returns
+            request.environ[STREAMING_CHAT_KEY] = chat
+            return Response(iter(()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        
+        response = Response(stream_with_context(chat.events()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Give the place back even if the client leaves before the stream starts
+        response.call_on_close(chat.release)
+        return response
+    except BaseException:
+        admission.release(ticket)
+        raise
+
+@app.route('/chat/messages')
+def chat_messages():
+    """Messages of the current conversation from index `after` on, for a page that already shows the earlier ones."""
+    after = max(0, request.args.get('after', 0, type=int))
+    messages = conversation_store.get_history(get_session_id(), start=after)
+    return jsonify({
+        'messages': [{
+            'index': after + i,
+            'role': message['role'],
+            'content': message['content'],
+            'html': str(message_html(message)) if message['role'] == 'assistant' else None,
+        } for i, message in enumerate(messages)],
+    })
+
+@app.route('/metrics')
+def metrics_route():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/save_conversation', methods=['POST'])
 def save_conversation_route():
-    conversation_history = session.get('conversation_history', [])
+    conversation_history = get_conversation_history()
     
     if not conversation_history:
         flash("No conversation to save", "warning")
         return redirect(url_for('chat'))
     
-    filename = save_conversation(conversation_history)
+    try:
+        conversation_id = save_conversation(conversation_history)
+    except Exception as e:
+        print(f"Error saving conversation: {e}")
+        conversation_id = None
     
-    if filename:
-        flash(f"Conversation saved to {filename}", "success")
+    if conversation_id:
+        flash(f"Conversation saved as {conversation_id}", "success")
     else:
         flash("Failed to save conversation", "error")
     
     return redirect(url_for('chat'))
 
+@app.route('/conversations')
+def conversations():
+    conversation_archive.import_json_files()
+    return render_template('conversations.html', conversations=conversation_archive.list_conversations())
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    results = []
+    if query:
+        conversation_archive.import_json_files()
+        results = conversation_archive.search_index.search(query)
+        for result in results:
+            # Highlight matched words after escaping the message text
+            result['snippet'] = Markup(str(escape(result['snippet']))
+                                       .replace(SNIPPET_START, '<mark>')
+                                       .replace(SNIPPET_END, '</mark>'))
+    return render_template('search.html', query=query, results=results)
+
+@app.route('/conversations/<conversation_id>')
+def conversation_detail(conversation_id):
+    conversation = conversation_archive.get(conversation_id)
+    if conversation is None:
+        flash("Conversation not found", "warning")
+        return redirect(url_for('conversations'))
+    messages = conversation_archive.load(conversation_id)
+    return render_template('conversation.html', conversation=conversation, messages=messages)
+
 @app.route('/train', methods=['GET', 'POST'])
 def train():
     form = TrainingForm()
@@ -345,25 +808,56 @@ def train():
     message = None
     
     if form.validate_on_submit():
-        training_text = form.training_text.data
         new_model_name = form.model_name.data
         base_model = form.base_model.data
         
+        # A model that is already being created gets the existing job
+        job = create_jobs.find('create', new_model_name)
+        if job is not None:
+            return redirect(url_for('train_status', job_id=job.id))
+        
         # Check if model name already exists
         if check_model_exists(new_model_name):
             success = False
             message = f"Model {new_model_name} already exists. Please choose a different name."
             return render_template('train.html', form=form, success=success, message=message)
         
-        # Train the model
-        success, message = train_model_on_text(training_text, new_model_name, base_model)
+        # The training job reads the content from disk, so it never sits in memory as a whole
+        upload = form.training_file.data
+        upload_path = os.path.join(UPLOAD_DIRECTORY, f"{new_model_name}-{uuid.uuid4().hex}.upload")
+        if upload:
+            filename = upload.filename
+            save_upload(upload.stream, upload_path)
+        else:
+            filename = "pasted.txt"
+            os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+            with open(upload_path, 'w', encoding='utf-8') as f:
+                f.write(form.training_text.data)
         
-        # Don't redirect - show success/error on the same page
-        if success:
-            # Also add a flash message for when redirecting to settings
-            flash(f"Model {new_model_name} created successfully!", "success")
+        # Queue the training and show its progress
+        try:
+            job = create_jobs.submit('create', new_model_name, train_model_on_upload,
+                                     upload_path, filename, new_model_name, base_model)
+        except JobQueueFull as e:
+            os.remove(upload_path)
+            success = False
+            message = str(e)
+            return render_template('train.html', form=form, success=success, message=message)
+        if job.args[0] != upload_path:
+            # Another request for the same model was queued since the check above; its job trains on its own upload
+            os.remove(upload_path)
+        
+        return redirect(url_for('train_status', job_id=job.id))
     
     return render_template('train.html', form=form, success=success, message=message)
 
+@app.route('/train/<job_id>')
+def train_status(job_id):
+    job = create_jobs.get(job_id)
+    if job is None:
+        flash("Unknown or expired training job", "warning")
+        return redirect(url_for('train'))
+    return render_template('train_status.html', job=job)
+
 if __name__ == '__main__':
     app.run(debug=True)
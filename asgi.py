@@ -0,0 +1,209 @@
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app import app, ASYNC_STREAM_KEY, STREAMING_CHAT_KEY
+from response_cache import response_cache
+
+# Threads that run the Flask views; streamed chat replies don't hold one
+THREADS = int(os.environ.get("OLLAMA_STUDIES_ASGI_THREADS", "32"))
+
+# Request bodies above this size, e.g. training file uploads, are spooled to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# How often a queued chat checks whether its model is free
+ADMISSION_POLL_INTERVAL = 0.05
+
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi")
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ for an ASGI HTTP scope and a file holding its request body."""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        ASYNC_STREAM_KEY: True,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(environ, emit, stopped):
+    # Runs in a worker thread: the whole WSGI call, including any body Flask streams itself
+    def start_response(status, headers, exc_info=None):
+        emit(('start', int(status.split(' ', 1)[0]),
+              [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+
+    try:
+        app_iter = app.wsgi_app(environ, start_response)
+        try:
+            for chunk in app_iter:
+                if stopped.is_set():
+                    break
+                if chunk:
+                    emit(('body', chunk))
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+    except Exception:
+        app.logger.exception("Unhandled error serving %s", environ.get('PATH_INFO'))
+    finally:
+        emit(('end',))
+
+
+async def read_body(receive):
+    """A file holding the request body, or None if the client disconnected before sending all of it."""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            body.seek(0)
+            return body
+
+
+async def wait_for_admission(ticket, timeout):
+    """Like admission.wait, without holding a thread while the ticket waits."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not ticket.granted and loop.time() < deadline:
+        await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+    return ticket.granted
+
+
+async def stream_chat(chat, send_event):
+    """The event-loop counterpart of StreamingChat.events()."""
+    try:
+        while not await wait_for_admission(chat.ticket, 1.0):
+            await send_event(chat.queued_event())
+        async for chunk in response_cache.chat_async(**chat.start()):
+            event = chat.on_chunk(chunk)
+            if event is not None:
+                await send_event(event)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await send_event(chat.fail(e))
+        return
+    finally:
+        chat.release()
+    # Storing the reply touches SQLite, so it goes back to a thread
+    await send_event(await asyncio.get_running_loop().run_in_executor(executor, chat.finish))
+
+
+async def respond(environ, send, stopped):
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+    loop.run_in_executor(executor, run_wsgi, environ,
+                         lambda message: loop.call_soon_threadsafe(messages.put_nowait, message), stopped)
+
+    started = False
+    while True:
+        message = await messages.get()
+        if message[0] == 'start':
+            started = True
+            await send({'type': 'http.response.start', 'status': message[1], 'headers': message[2]})
+        elif message[0] == 'body':
+            await send({'type': 'http.response.body', 'body': message[1], 'more_body': True})
+        else:
+            break
+
+    if not started:
+        await send({'type': 'http.response.start', 'status': 500,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+        return
+
+    chat = environ.get(STREAMING_CHAT_KEY)
+    if chat is not None:
+        async def send_event(event):
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await stream_chat(chat, send_event)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point for the web interface, e.g. `uvicorn asgi:application`.
+
+    Flask views run on a thread pool as they do under a WSGI server, but a
+    streamed chat reply is relayed from ollama.AsyncClient on the event
+    loop, so an open stream costs a socket rather than a thread. When the
+    client goes away mid-reply the stream is cancelled, which closes the
+    connection to Ollama and stops the generation.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    stopped = threading.Event()
+    environ = wsgi_environ(scope, body)
+    response = asyncio.ensure_future(respond(environ, send, stopped))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({response, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Stop whichever is still running: the reply once the client has gone, or the watcher once it is sent
+        stopped.set()
+        for task in (response, disconnect):
+            task.cancel()
+        await asyncio.gather(response, disconnect, return_exceptions=True)
+        body.close()
+        # A client that left before its stream started never reached stream_chat's release
+        chat = environ.get(STREAMING_CHAT_KEY)
+        if chat is not None:
+            chat.release()
+    if not response.cancelled() and response.exception() is not None:
+        raise response.exception()
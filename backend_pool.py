@@ -0,0 +1,358 @@
+import os
+import random
+import threading
+
+# ollama (with httpx and pydantic) takes longer to import than the rest of the
+# CLI together, so it is only imported once the first request is made
+
+# Comma-separated Ollama hosts; empty means the single host from OLLAMA_HOST (or localhost)
+HOSTS = os.environ.get("OLLAMA_STUDIES_HOSTS", "")
+
+# Seconds between health checks of each host, when there is more than one
+HEALTH_CHECK_INTERVAL = 10.0
+
+# Connecting to a host that is down should fail fast; generations can take as long as they need
+CONNECT_TIMEOUT = 5.0
+
+# Keep-alive connections kept open to each host
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+
+# Async streams don't tie up a thread each, so many more of them can be open at once
+MAX_ASYNC_CONNECTIONS = 512
+
+
+def base_name(model_name):
+    """Strip the default tag, so 'tinyllama:latest' and 'tinyllama' compare equal."""
+    return model_name[:-len(":latest")] if model_name.endswith(":latest") else model_name
+
+
+def is_host_failure(error):
+    """Whether an error means the host itself is unusable, rather than the request."""
+    import httpx
+    from ollama import ResponseError
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500 or error.status_code < 0
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+def should_fail_over(error):
+    """Whether a request that failed with this error may be retried on another host."""
+    from ollama import ResponseError
+    if isinstance(error, ResponseError) and error.status_code == 404:
+        # The model isn't on this host, but it may be on another one
+        return True
+    return is_host_failure(error)
+
+
+class Backend:
+    """One Ollama host, with what it is known to have and how busy it is."""
+
+    def __init__(self, host=None):
+        self.host = host
+        self._client = None
+        self._async_client = None
+        self.healthy = True
+        self.in_flight = 0
+        self.models = set()
+        self.resident = set()
+        self.list_response = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """ollama.Client for the host, created on first use."""
+        if self._client is None:
+            import httpx
+            import ollama
+            with self._lock:
+                if self._client is None:
+                    self._client = ollama.Client(
+                        host=self.host,
+                        timeout=httpx.Timeout(None, connect=CONNECT_TIMEOUT),
+                        limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        """ollama.AsyncClient for the host, created on first use inside the serving event loop."""
+        if self._async_client is None:
+            import httpx
+            import ollama
+            self._async_client = ollama.AsyncClient(
+                host=self.host,
+                timeout=httpx.Timeout(None, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=MAX_ASYNC_CONNECTIONS,
+                                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+            )
+        return self._async_client
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def mark_unhealthy(self):
+        self.healthy = False
+        self.resident = set()
+
+    def refresh_models(self):
+        """List the host's models; raises if the host can't be reached."""
+        response = self.client.list()
+        self.list_response = response
+        self.models = {base_name(model['model']) for model in response['models'] if model.get('model')}
+        self.healthy = True
+        return response
+
+    def refresh_resident(self):
+        response = self.client.ps()
+        self.resident = {base_name(model[key]) for model in response['models']
+                         for key in ('name', 'model') if model.get(key)}
+        self.healthy = True
+        return response
+
+    def check(self):
+        """Health check: refresh what the host has and has loaded."""
+        try:
+            self.refresh_models()
+            self.refresh_resident()
+        except Exception:
+            self.mark_unhealthy()
+
+    def to_dict(self):
+        return {
+            'host': self.host or os.environ.get('OLLAMA_HOST') or 'localhost',
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'models': sorted(self.models),
+            'resident': sorted(self.resident),
+        }
+
+
+class BackendPool:
+    """Routes Ollama requests across one or more hosts.
+
+    Each request goes to the least-loaded healthy host that already has the
+    model loaded, then to hosts that have it on disk, then to the rest, and
+    moves on to the next host if one can't be reached. Hosts are health
+    checked in the background, and a failed host is retried once a check
+    succeeds. The call signatures follow the ollama module's functions.
+    """
+
+    def __init__(self, hosts=None):
+        self.backends = [Backend(host) for host in (hosts or [None])]
+        self._health_thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        hosts = [host.strip() for host in HOSTS.split(",") if host.strip()]
+        return cls(hosts)
+
+    # Health checks
+
+    def _start_health_checks(self):
+        # A single host has nothing to route between, so it is never checked
+        if len(self.backends) < 2 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            for backend in self.backends:
+                backend.check()
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        stopped = threading.Event()
+        while not stopped.wait(HEALTH_CHECK_INTERVAL):
+            for backend in self.backends:
+                backend.check()
+
+    def status(self):
+        return [backend.to_dict() for backend in self.backends]
+
+    # Routing
+
+    def candidates(self, model=None):
+        """Return the hosts to try for a model, best first."""
+        self._start_health_checks()
+        name = base_name(model) if model else None
+
+        def rank(backend):
+            return (
+                not backend.healthy,
+                name is not None and name not in backend.resident,
+                name is not None and name not in backend.models,
+                backend.in_flight,
+                random.random(),
+            )
+
+        return sorted(self.backends, key=rank)
+
+    def _request(self, method, model, **kwargs):
+        last_error = None
+        for backend in self.candidates(model):
+            backend.begin()
+            try:
+                response = getattr(backend.client, method)(model=model, **kwargs)
+            except Exception as e:
+                if not should_fail_over(e):
+                    raise
+                if is_host_failure(e):
+                    backend.mark_unhealthy()
+                last_error = e
+                continue
+            finally:
+                backend.end()
+            self._record_success(backend, method, model)
+            return response
+        raise last_error
+
+    def _stream(self, method, model, **kwargs):
+        last_error = None
+        for backend in self.candidates(model):
+            backend.begin()
+            try:
+                stream = getattr(backend.client, method)(model=model, stream=True, **kwargs)
+                # Only a request that fails before its first chunk can be retried elsewhere
+                first = next(stream)
+            except StopIteration:
+                backend.end()
+                return
+            except Exception as e:
+                backend.end()
+                if not should_fail_over(e):
+                    raise
+                if is_host_failure(e):
+                    backend.mark_unhealthy()
+                last_error = e
+                continue
+            try:
+                yield first
+                yield from stream
+            except Exception as e:
+                if is_host_failure(e):
+                    backend.mark_unhealthy()
+                raise
+            finally:
+                backend.end()
+            self._record_success(backend, method, model)
+            return
+        raise last_error
+
+    async def _stream_async(self, method, model, **kwargs):
+        # The same routing and failover as _stream, over each host's AsyncClient
+        last_error = None
+        for backend in self.candidates(model):
+            backend.begin()
+            try:
+                stream = await getattr(backend.async_client, method)(model=model, stream=True, **kwargs)
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                backend.end()
+                return
+            except Exception as e:
+                backend.end()
+                if not should_fail_over(e):
+                    raise
+                if is_host_failure(e):
+                    backend.mark_unhealthy()
+                last_error = e
+                continue
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            except Exception as e:
+                if is_host_failure(e):
+                    backend.mark_unhealthy()
+                raise
+            finally:
+                backend.end()
+                # Closing the response stops Ollama generating, e.g. when the client went away
+                await stream.aclose()
+            self._record_success(backend, method, model)
+            return
+        raise last_error
+
+    def _record_success(self, backend, method, model):
+        name = base_name(model)
+        if method in ('chat', 'generate', 'embed', 'embeddings'):
+            backend.resident.add(name)
+            backend.models.add(name)
+        elif method == 'pull':
+            backend.models.add(name)
+
+    # Ollama API
+
+    def chat(self, model, stream=False, **kwargs):
+        if stream:
+            return self._stream('chat', model, **kwargs)
+        return self._request('chat', model, **kwargs)
+
+    def chat_async(self, model, **kwargs):
+        """Stream a chat response with ollama.AsyncClient; an async iterator of chunks."""
+        return self._stream_async('chat', model, **kwargs)
+
+    def generate(self, model, stream=False, **kwargs):
+        if stream:
+            return self._stream('generate', model, **kwargs)
+        return self._request('generate', model, **kwargs)
+
+    def embed(self, model, **kwargs):
+        return self._request('embed', model, **kwargs)
+
+    def embeddings(self, model, **kwargs):
+        return self._request('embeddings', model, **kwargs)
+
+    def pull(self, model, stream=False, **kwargs):
+        if stream:
+            return self._stream('pull', model, **kwargs)
+        return self._request('pull', model, **kwargs)
+
+    def list(self):
+        """Merge the model listings of every reachable host."""
+        if len(self.backends) == 1:
+            return self.backends[0].refresh_models()
+        from ollama import ListResponse
+        models = {}
+        last_error = None
+        for backend in self.backends:
+            try:
+                response = backend.refresh_models()
+            except Exception as e:
+                backend.mark_unhealthy()
+                last_error = e
+                continue
+            for model in response['models']:
+                models.setdefault(model['model'], model)
+        if not models and last_error is not None and not any(backend.healthy for backend in self.backends):
+            raise last_error
+        return ListResponse(models=list(models.values()))
+
+    def ps(self):
+        """Merge the running models of every reachable host."""
+        if len(self.backends) == 1:
+            return self.backends[0].refresh_resident()
+        from ollama import ProcessResponse
+        models = {}
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                response = backend.refresh_resident()
+            except Exception:
+                backend.mark_unhealthy()
+                continue
+            for model in response['models']:
+                models.setdefault(model['model'], model)
+        return ProcessResponse(models=list(models.values()))
+
+
+pool = BackendPool.from_environment()
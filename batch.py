@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from history_window import prompt_tokens
+from response_cache import response_cache
+
+DEFAULT_CONCURRENCY = 4
+
+
+def record_id(record, line_number):
+    """The id of an input record; records without one are identified by their line."""
+    for key in ('id', 'request_id'):
+        if record.get(key) is not None:
+            return str(record[key])
+    return f"line-{line_number}"
+
+
+def record_messages(record, system_prompt=None):
+    """Chat messages for an input record, from 'messages', 'prompt' or 'title'/'body'."""
+    if record.get('messages'):
+        messages = [{'role': message['role'], 'content': message['content']} for message in record['messages']]
+    elif record.get('prompt'):
+        messages = [{'role': 'user', 'content': record['prompt']}]
+    elif record.get('body'):
+        title = record.get('title')
+        messages = [{'role': 'user', 'content': f"{title}\n\n{record['body']}" if title else record['body']}]
+    else:
+        raise ValueError("Record has no 'messages', 'prompt' or 'body'")
+    system_prompt = record.get('system', system_prompt)
+    if system_prompt and messages[0]['role'] != 'system':
+        messages.insert(0, {'role': 'system', 'content': system_prompt})
+    return messages
+
+
+def completed_keys(output_path):
+    """(id, model) of the results already in the output file that succeeded.
+
+    Invalid input lines, recorded with no model, count as done too: they fail the same way on every run.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if not result.get('error') or result.get('model') is None:
+                done.add((result['id'], result.get('model')))
+    return done
+
+
+def read_tasks(input_path, models, done, counts):
+    """Lazily yield (id, model, record) for every record and model still to run.
+
+    A line that isn't a JSON object is yielded once, with no model and the error as its record,
+    unless an earlier run already recorded it.
+    """
+    with open(input_path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Record is not a JSON object")
+            except ValueError as e:
+                # Reported as a failed result, like any other bad record, and the run goes on
+                if (f"line-{line_number}", None) in done:
+                    counts['skipped'] += 1
+                else:
+                    yield f"line-{line_number}", None, ValueError(f"Invalid record on line {line_number}: {e}")
+                continue
+            task_id = record_id(record, line_number)
+            for model in ([record['model']] if record.get('model') else models):
+                if (task_id, model) in done:
+                    counts['skipped'] += 1
+                    continue
+                yield task_id, model, record
+
+
+def run_task(task_id, model, record, system_prompt, options):
+    """Generate one reply and return its result record with timing fields."""
+    result = {'id': task_id, 'model': model}
+    started = time.perf_counter()
+    try:
+        if isinstance(record, Exception):
+            raise record
+        messages = record_messages(record, system_prompt)
+        options = dict(options, **record.get('options', {}))
+        response_text = ""
+        ttft = None
+        stats = {}
+        for chunk in response_cache.chat(model=model, messages=messages, options=options, stream=True):
+            if 'message' in chunk and 'content' in chunk['message']:
+                if ttft is None and chunk['message']['content']:
+                    ttft = time.perf_counter() - started
+                response_text += chunk['message']['content']
+            if chunk.get('done'):
+                stats = metrics.observe_response(model, chunk, ttft, prompt_tokens(messages))
+                result['done_reason'] = chunk.get('done_reason')
+                result['cached'] = bool(chunk.get('cached'))
+        result['response'] = response_text
+        result.update(stats)
+    except Exception as e:
+        result['error'] = str(e)
+    result['latency'] = time.perf_counter() - started
+    return result
+
+
+def run_batch(input_path, output_path, models, concurrency=DEFAULT_CONCURRENCY, options=None,
+              system_prompt=None, progress=None):
+    """Run every record of a JSONL file against the models and append results to a JSONL file.
+
+    Input is read one line at a time and at most `concurrency` records are in
+    flight, so memory doesn't grow with the input. Results are written as they
+    finish, in completion order. Records that already have a successful result
+    in the output are skipped, so an interrupted run can simply be restarted.
+    progress(counts) is called after every result. Returns the final counts.
+    """
+    options = options or {}
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    tasks = read_tasks(input_path, models, completed_keys(output_path), counts)
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+
+    # Don't append to a line an interrupted run left unfinished
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    with open(output_path, 'a', encoding='utf-8') as output, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def finished(future):
+            result = future.result()
+            with lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                counts['failed' if result.get('error') else 'succeeded'] += 1
+                if progress is not None:
+                    progress(dict(counts))
+            slots.release()
+
+        for task_id, model, record in tasks:
+            # Wait for a free slot before reading further, so only `concurrency` records are held
+            slots.acquire()
+            future = executor.submit(run_task, task_id, model, record, system_prompt, options)
+            future.add_done_callback(finished)
+
+    return counts
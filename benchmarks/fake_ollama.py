@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""A stand-in for the Ollama HTTP API, for benchmarks and tests without real models.
+
+Implements /api/chat, /api/generate, /api/tags, /api/ps, /api/pull, /api/embed
+and /api/embeddings with a configurable time to first token, token rate and
+jitter. Like Ollama, each model keeps the last few prompts in a cache and only
+evaluates the part of a new prompt after the longest shared prefix. Point the
+app at it with OLLAMA_HOST=http://127.0.0.1:<port>.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_MODELS = ["tinyllama:latest", "gemma:2b", "phi:latest", "mistral:latest", "llama2:latest",
+                  "nomic-embed-text:latest"]
+
+
+class FakeOllamaConfig:
+    """Timing and content of the fake server's responses."""
+
+    def __init__(self, ttft=0.05, token_rate=50.0, jitter=0.1, response_tokens=32,
+                 embedding_dim=768, pull_size=64 * 1024 * 1024, pull_rate=512 * 1024 * 1024,
+                 models=None, seed=None, prompt_rate=2000.0, cache_slots=4, kv_bytes_per_token=128 * 1024):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.prompt_rate = prompt_rate
+        self.cache_slots = cache_slots
+        self.kv_bytes_per_token = kv_bytes_per_token
+        self.jitter = jitter
+        self.response_tokens = response_tokens
+        self.embedding_dim = embedding_dim
+        self.pull_size = pull_size
+        self.pull_rate = pull_rate
+        self.models = list(models or DEFAULT_MODELS)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.loaded = {}
+        self.context_lengths = {}
+        self.prompt_cache = {}
+
+    def delay(self, seconds):
+        """Return seconds with the configured relative jitter applied."""
+        if self.jitter:
+            with self.lock:
+                seconds *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, seconds)
+
+    def evaluate_prompt(self, model, prompt_text):
+        """Return how many prompt tokens aren't covered by a cached prompt, and cache this one."""
+        with self.lock:
+            slots = self.prompt_cache.setdefault(model, [])
+            shared = max((len(os.path.commonprefix([cached, prompt_text])) for cached in slots), default=0)
+            slots.append(prompt_text)
+            del slots[:-self.cache_slots]
+        return max(1, (len(prompt_text) - shared) // 4)
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def model_digest(name):
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def fake_embedding(text, dimensions):
+    """Deterministic pseudo-embedding of a text."""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each streamed chunk right away instead of waiting for delayed ACKs
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _send_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _check_model(self, name):
+        if name not in self.config.models and f"{name}:latest" not in self.config.models:
+            self._send_json({'error': f"model '{name}' not found"}, status=404)
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [
+                {'name': name, 'model': name, 'modified_at': now(), 'size': self.config.pull_size,
+                 'digest': model_digest(name), 'details': {'format': 'gguf', 'family': 'llama'}}
+                for name in self.config.models
+            ]})
+        elif self.path == '/api/ps':
+            with self.config.lock:
+                loaded = dict(self.config.loaded)
+                context_lengths = dict(self.config.context_lengths)
+            # Like Ollama's, a loaded model's memory grows with the KV cache for its context length
+            self._send_json({'models': [
+                {'name': name, 'model': name, 'digest': model_digest(name),
+                 'size': self.config.pull_size + context_lengths.get(name, 2048) * self.config.kv_bytes_per_token,
+                 'expires_at': expires_at, 'size_vram': 0}
+                for name, expires_at in loaded.items()
+            ]})
+        elif self.path in ('/', '/api/version'):
+            self._send_json({'version': '0.0.0-fake'})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except ValueError:
+            self._send_json({'error': 'invalid JSON'}, status=400)
+            return
+        routes = {
+            '/api/chat': self._chat,
+            '/api/generate': self._chat,
+            '/api/pull': self._pull,
+            '/api/embed': self._embed,
+            '/api/embeddings': self._embeddings,
+            '/api/show': self._show,
+        }
+        handler = routes.get(self.path)
+        if handler is None:
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        handler(request)
+
+    def _chat(self, request):
+        config = self.config
+        model = request.get('model', '')
+        if not self._check_model(model):
+            return
+        is_chat = self.path == '/api/chat'
+        messages = request.get('messages') or []
+        if is_chat:
+            prompt_text = "".join(f"<|{message.get('role')}|>{message.get('content') or ''}" for message in messages)
+        else:
+            prompt_text = request.get('prompt', '')
+        tokens = [f"tok{i} " for i in range(config.response_tokens)]
+
+        num_ctx = (request.get('options') or {}).get('num_ctx') or 2048
+        with config.lock:
+            # Changing the context length reloads the model, as it does in Ollama
+            first_load = model not in config.loaded or config.context_lengths.get(model) != num_ctx
+            config.loaded[model] = now()
+            config.context_lengths[model] = num_ctx
+        load_duration = config.delay(config.ttft) if first_load else 0.0
+
+        # Like Ollama, a generate request without a prompt only loads or unloads the model
+        if not is_chat and not request.get('prompt'):
+            if request.get('keep_alive') in (0, "0", "0s"):
+                with config.lock:
+                    config.loaded.pop(model, None)
+            time.sleep(load_duration)
+            self._send_json({'model': model, 'created_at': now(), 'response': '', 'done': True,
+                             'done_reason': 'load' if first_load else 'unload',
+                             'load_duration': int(load_duration * 1e9)})
+            return
+
+        prompt_tokens = config.evaluate_prompt(model, prompt_text)
+        start = time.perf_counter()
+        time.sleep(load_duration + config.delay(config.ttft + prompt_tokens / config.prompt_rate))
+        prompt_eval_duration = time.perf_counter() - start - load_duration
+
+        def final(content):
+            total = time.perf_counter() - start
+            data = {
+                'model': model,
+                'created_at': now(),
+                'done': True,
+                'done_reason': 'stop',
+                'total_duration': int(total * 1e9),
+                'load_duration': int(load_duration * 1e9),
+                'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int(prompt_eval_duration * 1e9),
+                'eval_count': len(tokens),
+                'eval_duration': int((total - prompt_eval_duration - load_duration) * 1e9),
+            }
+            if is_chat:
+                data['message'] = {'role': 'assistant', 'content': content}
+            else:
+                data['response'] = content
+            return data
+
+        if request.get('stream', True):
+            self._start_stream()
+            for token in tokens:
+                chunk = {'model': model, 'created_at': now(), 'done': False}
+                if is_chat:
+                    chunk['message'] = {'role': 'assistant', 'content': token}
+                else:
+                    chunk['response'] = token
+                self._send_chunk(chunk)
+                time.sleep(config.delay(1.0 / config.token_rate))
+            self._send_chunk(final(""))
+            self._end_stream()
+        else:
+            time.sleep(config.delay(len(tokens) / config.token_rate))
+            self._send_json(final("".join(tokens)))
+
+    def _pull(self, request):
+        config = self.config
+        model = request.get('model') or request.get('name', '')
+        step = max(1, config.pull_size // 16)
+        chunks = [{'status': 'pulling manifest'}]
+        for completed in range(0, config.pull_size + 1, step):
+            chunks.append({'status': f'pulling {model_digest(model)[:12]}', 'digest': 'sha256:' + model_digest(model),
+                           'total': config.pull_size, 'completed': min(completed, config.pull_size)})
+        chunks += [{'status': 'verifying sha256 digest'}, {'status': 'writing manifest'}, {'status': 'success'}]
+        with config.lock:
+            if model not in config.models:
+                config.models.append(model)
+
+        if request.get('stream', True):
+            self._start_stream()
+            for chunk in chunks:
+                self._send_chunk(chunk)
+                time.sleep(config.delay(step / config.pull_rate))
+            self._end_stream()
+        else:
+            time.sleep(config.delay(config.pull_size / config.pull_rate))
+            self._send_json({'status': 'success'})
+
+    def _embed(self, request):
+        model = request.get('model', '')
+        if not self._check_model(model):
+            return
+        texts = request.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep(self.config.delay(self.config.ttft / 10))
+        self._send_json({'model': model, 'embeddings': [fake_embedding(text, self.config.embedding_dim) for text in texts]})
+
+    def _embeddings(self, request):
+        model = request.get('model', '')
+        if not self._check_model(model):
+            return
+        time.sleep(self.config.delay(self.config.ttft / 10))
+        self._send_json({'embedding': fake_embedding(request.get('prompt', ''), self.config.embedding_dim)})
+
+    def _show(self, request):
+        model = request.get('model') or request.get('name', '')
+        if not self._check_model(model):
+            return
+        self._send_json({'modelfile': f'FROM {model}\n', 'parameters': '', 'template': '{{ .Prompt }}',
+                         'details': {'format': 'gguf', 'family': 'llama'}, 'modified_at': now()})
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Start a fake Ollama server in a background thread and return it.
+
+    The server's address is in server.server_address; call server.shutdown() to stop it.
+    """
+    handler = type('ConfiguredFakeOllamaHandler', (FakeOllamaHandler,), {'config': config or FakeOllamaConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_server_arguments(parser):
+    """Add the fake server's timing options to an argument parser."""
+    parser.add_argument("--ttft", type=float, default=0.05, help="Seconds before the first token (default 0.05)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Generated tokens per second (default 50)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative random jitter on all delays (default 0.1)")
+    parser.add_argument("--response-tokens", type=int, default=32, help="Tokens per response (default 32)")
+    parser.add_argument("--prompt-rate", type=float, default=2000.0,
+                        help="Uncached prompt tokens evaluated per second (default 2000)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the jitter")
+
+
+def config_from_args(args):
+    return FakeOllamaConfig(ttft=args.ttft, token_rate=args.token_rate, jitter=args.jitter,
+                            response_tokens=args.response_tokens, seed=args.seed, prompt_rate=args.prompt_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stand-in Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = start_server(config_from_args(args), args.host, args.port)
+    print(f"Fake Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""Latency and throughput benchmarks against a stand-in Ollama server.
+
+Starts benchmarks/fake_ollama.py in-process, points the Ollama client at it and
+drives app.py's routes through Flask's test client, and main.chat_with_model
+with scripted input, at a configurable concurrency. Prints a summary table and
+writes machine-readable results with --output, so runs can be compared across
+commits with --compare.
+
+    python benchmarks/run_benchmarks.py --requests 200 --concurrency 8 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import start_server, add_server_arguments, config_from_args
+
+# chat_retrieval comes last: the index it builds would add training context to the chats of later scenarios
+SCENARIOS = ["settings", "check_model", "chat", "chat_stream", "save_conversation", "cli_chat", "chat_retrieval"]
+
+BENCH_MODEL = "tinyllama:latest"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values, scale=1.0):
+    if not values:
+        return None
+    return {
+        'mean': sum(values) / len(values) * scale,
+        'p50': percentile(values, 50) * scale,
+        'p95': percentile(values, 95) * scale,
+        'p99': percentile(values, 99) * scale,
+        'max': max(values) * scale,
+    }
+
+
+class Sample:
+    """Measurements of one benchmarked request."""
+
+    def __init__(self):
+        self.latency = None
+        self.ttft = None
+        self.cpu = None
+        self.allocated = None
+        self.error = None
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.app_module = None
+        self.main_module = None
+        self._cli_local = threading.local()
+        self._context_local = threading.local()
+        self._train_lock = threading.Lock()
+        self._trained = False
+
+    # Setup
+
+    def setup(self):
+        import app
+        import main
+        from rich.console import Console
+
+        app.app.config['WTF_CSRF_ENABLED'] = False
+        app.app.config['TESTING'] = True
+        self.app_module = app
+        self.main_module = main
+
+        # Scripted terminal for the CLI: per-thread input, output timestamps instead of text
+        benchmark = self
+
+        class ScriptedPrompt:
+            @staticmethod
+            def ask(*args, **kwargs):
+                local = benchmark._cli_local
+                local.turn_started = time.perf_counter()
+                local.writes = 0
+                return next(local.inputs)
+
+        class ScriptedConfirm:
+            @staticmethod
+            def ask(*args, **kwargs):
+                return False
+
+        class TimingWriter:
+            def write(self, text):
+                local = benchmark._cli_local
+                if getattr(local, 'turn_started', None) is not None:
+                    local.writes += 1
+                    # The first write after a prompt is the "LLM>" marker, the next one the first token
+                    if local.writes == 2:
+                        local.first_tokens.append(time.perf_counter())
+                return len(text)
+
+            def flush(self):
+                pass
+
+        main.Prompt = ScriptedPrompt
+        main.Confirm = ScriptedConfirm
+        main.console = Console(file=TimingWriter(), force_terminal=False)
+
+        # Remember the context message of each chat, so chat_retrieval can check retrieval ran
+        build_context_message = app.build_context_message
+
+        def recording_build_context_message(*args, **kwargs):
+            message = build_context_message(*args, **kwargs)
+            benchmark._context_local.message = message
+            return message
+
+        app.build_context_message = recording_build_context_message
+
+    def new_client(self):
+        client = self.app_module.app.test_client()
+        client.post('/settings', data={
+            'model': BENCH_MODEL,
+            'temperature': 0.7,
+            'context_length': 2048,
+            'system_prompt': "You are a helpful AI assistant.",
+        })
+        return client
+
+    # Scenarios; each runs one request and fills in the sample
+
+    def run_settings(self, client, sample, i):
+        response = client.get('/settings')
+        if response.status_code != 200:
+            sample.error = f"HTTP {response.status_code}"
+
+    def run_check_model(self, client, sample, i):
+        response = client.get(f'/check_model/{BENCH_MODEL}')
+        if response.status_code != 200 or not response.get_json().get('exists'):
+            sample.error = f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}"
+
+    def run_chat(self, client, sample, i):
+        response = client.post('/chat', data={'message': f"Benchmark question number {i}"})
+        if response.status_code != 200:
+            sample.error = f"HTTP {response.status_code}"
+
+    def run_chat_retrieval(self, client, sample, i):
+        self.train_bench_model()
+        self._context_local.message = None
+        response = client.post('/chat', data={'message': f"What do the notes say about topic {i % 8}?"})
+        if response.status_code != 200:
+            sample.error = f"HTTP {response.status_code}"
+        elif self._context_local.message is None:
+            sample.error = f"No training context retrieved for {BENCH_MODEL}"
+
+    def train_bench_model(self):
+        """Index training notes for the model under its plain name, as /train does.
+
+        Chats use the name as the settings dropdown lists it, with ':latest'.
+        """
+        import retrieval
+        with self._train_lock:
+            if self._trained:
+                return
+            notes = "\n\n".join(f"Notes on topic {n}: " + "details of the topic. " * 40 for n in range(8))
+            retrieval.build_index(BENCH_MODEL[:-len(":latest")], notes)
+            self._trained = True
+
+    def run_chat_stream(self, client, sample, i, started):
+        response = client.post('/chat/stream', data={'message': f"Benchmark question number {i}"}, buffered=False)
+        try:
+            if response.status_code != 200:
+                sample.error = f"HTTP {response.status_code}"
+                return
+            for data in response.response:
+                if sample.ttft is None and b"event: token" in data:
+                    sample.ttft = time.perf_counter() - started
+                if b"event: error" in data:
+                    sample.error = data.decode('utf-8', 'replace')[:200]
+        finally:
+            response.close()
+
+    def run_save_conversation(self, client, sample, i):
+        client.post('/chat', data={'message': f"Question to save {i}"})
+        response = client.post('/save_conversation')
+        if response.status_code not in (200, 302):
+            sample.error = f"HTTP {response.status_code}"
+
+    def run_cli_chat(self, client, sample, i, started):
+        local = self._cli_local
+        local.inputs = iter([f"Benchmark question number {i}", "exit"])
+        local.first_tokens = []
+        local.turn_started = None
+        settings = {'model': BENCH_MODEL, 'temperature': 0.7, 'num_ctx': 2048,
+                    'system': "You are a helpful AI assistant."}
+        self.main_module.chat_with_model(settings)
+        if local.first_tokens:
+            sample.ttft = local.first_tokens[0] - started
+
+    # Driver
+
+    def run_scenario(self, name):
+        args = self.args
+        run = getattr(self, f"run_{name}")
+        timed_from_start = name in ("chat_stream", "cli_chat")
+        track_allocations = args.allocations and args.concurrency == 1
+        samples = []
+        samples_lock = threading.Lock()
+        counter = iter(range(args.requests))
+        counter_lock = threading.Lock()
+
+        def worker():
+            client = self.new_client()
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                sample = Sample()
+                if track_allocations:
+                    tracemalloc.reset_peak()
+                    allocated_before = tracemalloc.get_traced_memory()[0]
+                cpu_start = time.thread_time()
+                started = time.perf_counter()
+                try:
+                    if timed_from_start:
+                        run(client, sample, i, started)
+                    else:
+                        run(client, sample, i)
+                except Exception as e:
+                    sample.error = f"{type(e).__name__}: {e}"
+                sample.latency = time.perf_counter() - started
+                sample.cpu = time.thread_time() - cpu_start
+                if track_allocations:
+                    sample.allocated = tracemalloc.get_traced_memory()[1] - allocated_before
+                with samples_lock:
+                    samples.append(sample)
+
+        if track_allocations:
+            tracemalloc.start()
+        prompt_before = {name: getattr(self.app_module.metrics, name).totals()
+                         for name in ('prompt_eval_count', 'prompt_reuse')}
+        wall_start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - wall_start
+        if track_allocations:
+            tracemalloc.stop()
+
+        # Mean prompt tokens Ollama evaluated per generation, and the share it took from its cache
+        prompt_means = {}
+        for name, (sum_before, count_before) in prompt_before.items():
+            total, count = getattr(self.app_module.metrics, name).totals()
+            prompt_means[name] = (total - sum_before) / (count - count_before) if count > count_before else None
+
+        succeeded = [sample for sample in samples if sample.error is None]
+        errors = [sample.error for sample in samples if sample.error is not None]
+        return {
+            'requests': len(samples),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'wall_seconds': wall,
+            'requests_per_second': len(samples) / wall if wall else None,
+            'latency_ms': summarize([sample.latency for sample in succeeded], 1000),
+            'ttft_ms': summarize([sample.ttft for sample in succeeded if sample.ttft is not None], 1000),
+            'cpu_ms': summarize([sample.cpu for sample in succeeded], 1000),
+            'peak_alloc_kb': summarize([sample.allocated for sample in succeeded if sample.allocated is not None], 1 / 1024),
+            'prompt_eval_tokens_mean': prompt_means['prompt_eval_count'],
+            'prompt_reuse_mean': prompt_means['prompt_reuse'],
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def format_stat(stats, key='p50'):
+    if not stats:
+        return "-"
+    return f"{stats[key]:.1f}"
+
+
+def format_mean(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(results):
+    print(f"{'scenario':<18} {'req':>5} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'ttft p50':>9} {'cpu p50':>8} {'alloc KB':>9} {'prompt tok':>10} {'reused':>7}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<18} {result['requests']:>5} {result['errors']:>4} {result['requests_per_second']:>8.1f} "
+              f"{format_stat(result['latency_ms']):>8} {format_stat(result['latency_ms'], 'p95'):>8} "
+              f"{format_stat(result['latency_ms'], 'p99'):>8} {format_stat(result['ttft_ms']):>9} "
+              f"{format_stat(result['cpu_ms']):>8} {format_stat(result['peak_alloc_kb']):>9} "
+              f"{format_mean(result.get('prompt_eval_tokens_mean'), '.1f'):>10} "
+              f"{format_mean(result.get('prompt_reuse_mean'), '.0%'):>7}")
+        if result['first_error']:
+            print(f"    first error: {result['first_error']}")
+
+
+def print_comparison(baseline, results):
+    """Print the change in p50/p95 latency and throughput against a previous run."""
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for name, result in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous or not previous.get('latency_ms') or not result.get('latency_ms'):
+            continue
+        changes = []
+        for key in ('p50', 'p95'):
+            before, after = previous['latency_ms'][key], result['latency_ms'][key]
+            changes.append(f"{key} {before:.1f} -> {after:.1f} ms ({(after - before) / before * 100:+.0f}%)")
+        before, after = previous['requests_per_second'], result['requests_per_second']
+        changes.append(f"req/s {before:.1f} -> {after:.1f} ({(after - before) / before * 100:+.0f}%)")
+        print(f"  {name:<18} " + ", ".join(changes))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the web and CLI front ends against a fake Ollama server.")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario (default 50)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients (default 4)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run (default: {','.join(SCENARIOS)})")
+    parser.add_argument("--allocations", action="store_true",
+                        help="Track per-request peak allocations with tracemalloc (only with --concurrency 1)")
+    parser.add_argument("--backends", type=int, default=1,
+                        help="Number of fake Ollama servers to spread requests across (default 1)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with results previously written by --output")
+    add_server_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    servers = [start_server(config_from_args(args)) for _ in range(args.backends)]
+    hosts = [f"http://127.0.0.1:{server.server_address[1]}" for server in servers]
+    os.environ['OLLAMA_HOST'] = hosts[0]
+    if args.backends > 1:
+        os.environ['OLLAMA_STUDIES_HOSTS'] = ",".join(hosts)
+    os.environ.setdefault('OLLAMA_STUDIES_CONVERSATION_STORE', 'memory')
+
+    # The app writes conversations and indexes relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="ollama-studies-bench-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        benchmark = Benchmark(args)
+        benchmark.setup()
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'backends': args.backends,
+                'server': {'ttft': args.ttft, 'token_rate': args.token_rate, 'jitter': args.jitter,
+                           'response_tokens': args.response_tokens, 'prompt_rate': args.prompt_rate},
+            },
+            'scenarios': {},
+        }
+        for name in scenarios:
+            results['scenarios'][name] = benchmark.run_scenario(name)
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server in servers:
+            server.shutdown()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Cold-start benchmark of the CLI.
+
+Imports main.py in fresh interpreters under `python -X importtime` to break
+the import time down by module, and starts main.py against a stand-in Ollama
+server to time how long it takes until the first prompt is shown. Writes
+machine-readable results with --output, so runs can be compared across commits
+with --compare.
+
+    python benchmarks/startup_benchmark.py --runs 10 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import start_server
+from run_benchmarks import summarize, git_commit, format_stat
+
+# Printed by main.py when it first waits for input, whether or not Ollama is found
+FIRST_PROMPT_MARKERS = (b"Select a model", b"Do you want to install Ollama")
+
+# Modules imported directly by main.py shown in the report
+TOP_MODULES = 10
+
+
+def parse_importtime(output):
+    """(module, cumulative microseconds, depth) for each line of -X importtime output."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            # The header line
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(cumulative), depth))
+    return imports
+
+
+def measure_imports(runs, env, workdir):
+    """Time `import main` in fresh interpreters, in total and per module main imports directly."""
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=workdir,
+                                env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"import main failed:\n{result.stderr[-2000:]}")
+        imports = parse_importtime(result.stderr)
+        depth = None
+        for name, cumulative, level in reversed(imports):
+            # Output is in completion order, so main comes after everything it imported
+            if name == "main":
+                depth = level
+                totals.append(cumulative / 1000.0)
+            elif depth is not None and level == depth + 1:
+                modules.setdefault(name, []).append(cumulative / 1000.0)
+            elif depth is not None and level <= depth:
+                break
+    return {
+        'import_ms': summarize(totals),
+        'modules_ms': {name: summarize(values) for name, values in modules.items()},
+    }
+
+
+def measure_first_prompt(runs, env, workdir, timeout=30.0):
+    """Time from starting main.py to its first prompt, in fresh processes."""
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "main.py")], cwd=workdir, env=env,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output = b""
+        try:
+            while not any(marker in output for marker in FIRST_PROMPT_MARKERS):
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    raise RuntimeError(f"main.py exited before its first prompt:\n{output.decode(errors='replace')}")
+                output += chunk
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("main.py didn't show a prompt in time")
+            durations.append(time.perf_counter() - started)
+        finally:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+            process.stdin.close()
+    return summarize(durations, scale=1000.0)
+
+
+def baseline_interpreter(runs, env):
+    """Time to start and exit an interpreter that imports nothing, for reference."""
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+        durations.append(time.perf_counter() - started)
+    return summarize(durations, scale=1000.0)
+
+
+def print_report(results):
+    print(f"{'measurement':<28} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for label, key in (("python -c pass", 'interpreter_ms'), ("import main", 'import_ms'),
+                       ("main.py to first prompt", 'first_prompt_ms')):
+        stats = results[key]
+        print(f"{label:<28} {format_stat(stats):>8} {format_stat(stats, 'p95'):>8} {format_stat(stats, 'max'):>8}")
+    print("\nSlowest imports of main.py (cumulative p50 ms):")
+    modules = sorted(results['modules_ms'].items(), key=lambda item: item[1]['p50'], reverse=True)
+    for name, stats in modules[:TOP_MODULES]:
+        print(f"  {name:<26} {stats['p50']:>8.1f}")
+
+
+def print_comparison(baseline, results):
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for key in ('import_ms', 'first_prompt_ms'):
+        if not baseline.get(key) or not results.get(key):
+            continue
+        before, after = baseline[key]['p50'], results[key]['p50']
+        print(f"  {key:<18} p50 {before:.1f} -> {after:.1f} ms ({(after - before) / before * 100:+.0f}%)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CLI's cold start.")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per measurement (default 10)")
+    parser.add_argument("--budget-ms", type=float, default=200.0,
+                        help="Exit with an error if the p50 time to first prompt is above this (default 200)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with results previously written by --output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = start_server()
+    env = dict(os.environ, OLLAMA_HOST=f"http://127.0.0.1:{server.server_address[1]}",
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.pop('OLLAMA_STUDIES_HOSTS', None)
+
+    # main.py keeps conversations relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="ollama-studies-startup-")
+    try:
+        # Warm the bytecode cache once, so every run measures the same thing
+        subprocess.run([sys.executable, "-c", "import main"], cwd=workdir, env=env, check=True)
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'runs': args.runs,
+            },
+            'interpreter_ms': baseline_interpreter(args.runs, env),
+            'first_prompt_ms': measure_first_prompt(args.runs, env, workdir),
+        }
+        results.update(measure_imports(args.runs, env, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        server.shutdown()
+
+    print_report(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if results['first_prompt_ms']['p50'] > args.budget_ms:
+        sys.exit(f"\nTime to first prompt is over the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import metrics
+from backend_pool import pool
+from history_window import history_budget, message_tokens, count_tokens
+from jobs import JobRunner
+
+# Model that writes the summaries; a small one keeps compaction cheap. Empty disables compaction.
+SUMMARY_MODEL = os.environ.get("OLLAMA_STUDIES_SUMMARY_MODEL", "tinyllama")
+
+# Share of the history budget the uncompacted turns may fill before the oldest are summarized.
+# It is below the point where the window starts dropping turns, so the summary is usually
+# ready before anything would be lost.
+COMPACT_THRESHOLD = 0.75
+
+# Share of the history budget the recent turns left after a compaction may fill. The gap to
+# COMPACT_THRESHOLD sets how many turns pass between compactions, and with them changes
+# to the summary at the start of the prompt.
+KEEP_RECENT = 0.35
+
+# Upper bound on the length of a summary
+SUMMARY_MAX_TOKENS = 256
+
+# How long to pause compaction after a summary failed, e.g. because the model isn't pulled
+RETRY_INTERVAL = 60.0
+
+# Conversations whose summaries are kept in memory
+MAX_CONVERSATIONS = 1024
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Merge the summary so far with the new messages into one updated summary. Keep names, numbers, "
+    "facts the user stated, decisions and open questions; drop small talk. Write at most "
+    f"{SUMMARY_MAX_TOKENS * 3 // 4} words of plain sentences and nothing else."
+)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def message_anchor(message):
+    """Fingerprint of a message, to tell whether a summary still belongs to a history."""
+    return hashlib.sha1(f"{message['role']}\n{message['content']}".encode('utf-8')).hexdigest()
+
+
+class ConversationSummary:
+    """A summary of the first `covered` messages of a conversation."""
+
+    def __init__(self, text, covered, anchor):
+        self.text = text
+        self.covered = covered
+        self.anchor = anchor
+
+    def matches(self, conversation_history):
+        """Whether the summary was made from the start of this history."""
+        return self.covered <= len(conversation_history) \
+            and message_anchor(conversation_history[self.covered - 1]) == self.anchor
+
+    def to_message(self):
+        return {"role": "system", "content": SUMMARY_PREFIX + self.text}
+
+
+class ConversationCompactor:
+    """Folds the oldest turns of long conversations into a rolling summary.
+
+    Once the turns after the current summary pass COMPACT_THRESHOLD of the
+    history budget, a background job asks SUMMARY_MODEL to merge the oldest
+    of them into the summary, leaving the recent turns that fill up to
+    KEEP_RECENT of the budget. The new summary replaces the old one in a
+    single step once it is complete, and prompts are then built from the
+    summary and the recent turns. The history itself is never changed, so
+    the front ends still show and archive every original turn.
+    """
+
+    def __init__(self, model=SUMMARY_MODEL, chat=None, runner=None):
+        self.model = model
+        self._chat = chat or pool.chat
+        self._runner = runner or JobRunner(workers=1, max_queue=16)
+        self._lock = threading.Lock()
+        self._summaries = OrderedDict()
+        self._failed_at = None
+
+    @property
+    def enabled(self):
+        return bool(self.model)
+
+    def summary(self, key, conversation_history):
+        """The summary of the conversation, or None if it has none that matches this history."""
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+        if summary is None or not summary.matches(conversation_history):
+            return None
+        return summary
+
+    def compacted(self, key, conversation_history):
+        """Return the summary message (or None) and the turns after it, to build a prompt from."""
+        summary = self.summary(key, conversation_history)
+        if summary is None:
+            return None, conversation_history
+        return summary.to_message(), conversation_history[summary.covered:]
+
+    def compaction_point(self, conversation_history, start, budget):
+        """Index up to which turns should be summarized, or None if the turns since start still fit."""
+        recent = [message_tokens(message) for message in conversation_history[start:]]
+        if sum(recent) <= budget * COMPACT_THRESHOLD:
+            return None
+        # Keep the most recent turns that fill the low-water share of the budget, and always the latest one
+        kept = 0
+        cut = len(conversation_history)
+        while cut - 1 > start and kept + recent[cut - 1 - start] <= budget * KEEP_RECENT:
+            cut -= 1
+            kept += recent[cut - start]
+        cut = min(cut, len(conversation_history) - 1)
+        # The recent turns start with a user message, like a conversation does
+        while cut > start and conversation_history[cut].get('role') == 'assistant':
+            cut -= 1
+        return cut if cut > start else None
+
+    def maybe_compact(self, key, conversation_history, num_ctx, system_prompt=None):
+        """Start summarizing the oldest turns in the background if the conversation has grown too long."""
+        if not self.enabled or not num_ctx or num_ctx <= 0:
+            return None
+        if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_INTERVAL:
+            return None
+
+        previous = self.summary(key, conversation_history)
+        start = previous.covered if previous is not None else 0
+        budget = history_budget(num_ctx, system_prompt)
+        if previous is not None:
+            budget -= count_tokens(previous.to_message()['content'])
+        cut = self.compaction_point(conversation_history, start, budget)
+        if cut is None:
+            return None
+        try:
+            return self._runner.submit('compact', key, self._compact, key, list(conversation_history[:cut]),
+                                       previous)
+        except Exception as e:
+            print(f"Error scheduling conversation compaction: {e}")
+            return None
+
+    def _compact(self, job, key, messages, previous):
+        start = previous.covered if previous is not None else 0
+        transcript = "\n\n".join(f"{'User' if message['role'] == 'user' else 'Assistant'}: {message['content']}"
+                                 for message in messages[start:])
+        job.update(message=f"Summarizing {len(messages) - start} messages")
+        try:
+            response = self._chat(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": f"Summary so far:\n{previous.text if previous else '(none)'}"
+                                                f"\n\nNew messages:\n{transcript}"},
+                ],
+                options={"temperature": 0, "num_predict": SUMMARY_MAX_TOKENS},
+            )
+            text = response['message']['content'].strip()
+            if not text:
+                raise ValueError("The summary model returned an empty summary")
+        except Exception:
+            metrics.compactions.inc(result='failed')
+            self._failed_at = time.monotonic()
+            raise
+
+        summary = ConversationSummary(text, len(messages), message_anchor(messages[-1]))
+        self._failed_at = None
+        with self._lock:
+            # Swap the new summary in, unless the conversation was cleared or compacted meanwhile
+            current = self._summaries.get(key)
+            if current is previous or (previous is None and not current.matches(messages)):
+                self._summaries[key] = summary
+                self._summaries.move_to_end(key)
+                while len(self._summaries) > MAX_CONVERSATIONS:
+                    self._summaries.popitem(last=False)
+        metrics.compactions.inc(result='ok')
+        return len(messages)
+
+    def forget(self, key):
+        """Drop the summary of a conversation that was cleared."""
+        with self._lock:
+            self._summaries.pop(key, None)
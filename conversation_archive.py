@@ -0,0 +1,290 @@
+import os
+import glob
+import gzip
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: processes sharing an archive aren't coordinated
+    fcntl = None
+
+ARCHIVE_DIRECTORY = os.path.join("conversations", "archive")
+
+# Size at which the active segment is sealed and a new one started
+SEGMENT_SIZE = 8 * 1024 * 1024
+
+
+class ConversationArchive:
+    """Append-only archive of saved conversations.
+
+    Turns are appended as compact JSON lines to segment files. A small
+    append-only index records each conversation's metadata and the byte
+    offset of every turn, so conversations can be listed from the index alone
+    and loaded without parsing any other conversation. With compress=True,
+    sealed segments are gzipped; offsets stay in uncompressed coordinates.
+    Appended turns are also added to the search index, if one is given.
+
+    Several processes, e.g. the web app and the CLI, may share a directory.
+    Writers take turns through a lock file, and every call first reads the
+    index lines other processes appended since the last one.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIRECTORY, compress=False, segment_size=SEGMENT_SIZE, search_index=None):
+        self.directory = directory
+        self.compress = compress
+        self.segment_size = segment_size
+        self.search_index = search_index
+        self._lock = threading.Lock()
+        self._conversations = None
+        self._index_offset = 0
+        self._sources = set()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the archive for writing, against other threads and other processes."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(".lock"), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """Apply the index lines appended since the last call, by this or another process."""
+        first = self._conversations is None
+        if first:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conversations = {}
+        if os.path.exists(self._path("index.jsonl")):
+            with open(self._path("index.jsonl"), 'rb') as f:
+                f.seek(self._index_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A line still being written; it is read on a later call
+                        break
+                    self._index_offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Skip a line cut short by an interrupted write
+                        continue
+                    self._apply(entry)
+
+        # Index conversations archived before the search index existed
+        if first and self.search_index is not None and self._conversations and self.search_index.is_empty():
+            for conversation in self._conversations.values():
+                messages = self._read_turns(conversation['turns'])
+                self.search_index.add_many([(conversation['id'], turn, message)
+                                            for turn, message in enumerate(messages)])
+
+    def _apply(self, entry):
+        if entry['type'] == 'conversation':
+            self._conversations[entry['id']] = {
+                'id': entry['id'],
+                'model': entry.get('model'),
+                'started_at': entry.get('started_at'),
+                'source': entry.get('source'),
+                'turns': [],
+            }
+            if entry.get('source'):
+                self._sources.add(entry['source'])
+        elif entry['type'] == 'turn' and entry['id'] in self._conversations:
+            self._conversations[entry['id']]['turns'].append((entry['segment'], entry['offset'], entry['length']))
+        elif entry['type'] == 'sealed':
+            for conversation in self._conversations.values():
+                conversation['turns'] = [
+                    (entry['to'] if segment == entry['segment'] else segment, offset, length)
+                    for segment, offset, length in conversation['turns']
+                ]
+
+    def _write_index(self, entry):
+        # Applied by reading it back, after any lines other processes wrote before it
+        with open(self._path("index.jsonl"), 'a') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        self._load_index()
+
+    def _current_segment(self):
+        """The segment to keep appending to, unless the last one was sealed."""
+        segments = sorted(glob.glob(self._path("segment-*")))
+        if segments and segments[-1].endswith(".jsonl"):
+            return os.path.basename(segments[-1])
+        return None
+
+    def _next_segment(self):
+        segments = sorted(glob.glob(self._path("segment-*")))
+        number = 1
+        if segments:
+            number = int(os.path.basename(segments[-1]).split('-')[1].split('.')[0]) + 1
+        return f"segment-{number:06d}.jsonl"
+
+    def _seal(self, segment):
+        """Compress a full segment and point the index at the compressed copy."""
+        compressed = segment + ".gz"
+        with open(self._path(segment), 'rb') as source, gzip.open(self._path(compressed), 'wb') as target:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                target.write(block)
+        self._write_index({'type': 'sealed', 'segment': segment, 'to': compressed})
+        os.remove(self._path(segment))
+
+    def start_conversation(self, model=None, started_at=None, source=None):
+        """Register a new conversation and return its id."""
+        with self._locked():
+            self._load_index()
+            return self._start_conversation(model, started_at, source)
+
+    def _start_conversation(self, model, started_at, source):
+        conversation_id = datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:8]
+        self._write_index({
+            'type': 'conversation',
+            'id': conversation_id,
+            'model': model,
+            'started_at': started_at or datetime.now().isoformat(timespec='seconds'),
+            'source': source,
+        })
+        return conversation_id
+
+    def append(self, conversation_id, message):
+        """Append a single turn to a conversation."""
+        with self._locked():
+            self._load_index()
+            self._append(conversation_id, message)
+
+    def _append(self, conversation_id, message):
+        if conversation_id not in self._conversations:
+            raise KeyError(f"Unknown conversation {conversation_id}")
+        line = (json.dumps(message, separators=(',', ':')) + "\n").encode('utf-8')
+
+        segment = self._current_segment()
+        if segment is None or os.path.getsize(self._path(segment)) >= self.segment_size:
+            previous = segment
+            segment = self._next_segment()
+            if previous and self.compress:
+                self._seal(previous)
+
+        with open(self._path(segment), 'ab') as f:
+            offset = f.tell()
+            f.write(line)
+        turn = len(self._conversations[conversation_id]['turns'])
+        self._write_index({
+            'type': 'turn',
+            'id': conversation_id,
+            'segment': segment,
+            'offset': offset,
+            'length': len(line),
+        })
+        if self.search_index is not None:
+            self.search_index.add(conversation_id, turn, message)
+
+    def extend(self, conversation_id, messages):
+        for message in messages:
+            self.append(conversation_id, message)
+
+    def save(self, conversation_history, model=None, conversation_id=None, archived_turns=0):
+        """Archive the turns of a conversation that weren't archived yet.
+
+        Returns the conversation id and the number of turns now archived, to be
+        passed back on the next save of the same conversation.
+        """
+        with self._lock:
+            self._load_index()
+            known = conversation_id in self._conversations
+        if not known:
+            conversation_id = self.start_conversation(model=model)
+            archived_turns = 0
+        self.extend(conversation_id, conversation_history[archived_turns:])
+        return conversation_id, len(conversation_history)
+
+    def list_conversations(self):
+        """Return the metadata of all conversations, newest first."""
+        with self._lock:
+            self._load_index()
+            conversations = [
+                {
+                    'id': conversation['id'],
+                    'model': conversation['model'],
+                    'started_at': conversation['started_at'],
+                    'turn_count': len(conversation['turns']),
+                }
+                for conversation in self._conversations.values()
+            ]
+        return sorted(conversations, key=lambda conversation: conversation['started_at'] or '', reverse=True)
+
+    def get(self, conversation_id):
+        """Return the metadata of a conversation, or None if it isn't archived."""
+        for conversation in self.list_conversations():
+            if conversation['id'] == conversation_id:
+                return conversation
+        return None
+
+    def load(self, conversation_id):
+        """Read the turns of a single conversation."""
+        with self._lock:
+            self._load_index()
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return None
+            turns = list(conversation['turns'])
+        return self._read_turns(turns)
+
+    def _read_turns(self, turns):
+        """Read the messages at the given (segment, offset, length) locations."""
+        messages = []
+        handles = {}
+        try:
+            for segment, offset, length in turns:
+                if segment not in handles:
+                    opener = gzip.open if segment.endswith(".gz") else open
+                    handles[segment] = opener(self._path(segment), 'rb')
+                f = handles[segment]
+                f.seek(offset)
+                messages.append(json.loads(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+        return messages
+
+    def import_json_files(self, pattern=os.path.join("conversations", "*.json")):
+        """Import conversations saved as JSON files by earlier versions.
+
+        Files already imported are skipped. Returns the number of new imports.
+        """
+        # Checked and imported under the lock, so processes sharing the archive import each file once
+        imported = 0
+        with self._locked():
+            self._load_index()
+            for path in sorted(glob.glob(pattern)):
+                if os.path.basename(path) in self._sources:
+                    continue
+                try:
+                    with open(path) as f:
+                        messages = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Error importing {path}: {e}")
+                    continue
+                started_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+                # Files are named conversation_<YYYYmmdd_HHMMSS>.json
+                try:
+                    stamp = os.path.basename(path)[len("conversation_"):-len(".json")]
+                    started_at = datetime.strptime(stamp, "%Y%m%d_%H%M%S").isoformat(timespec='seconds')
+                except ValueError:
+                    pass
+                conversation_id = self._start_conversation(None, started_at, os.path.basename(path))
+                for message in messages:
+                    self._append(conversation_id, message)
+                imported += 1
+        return imported
@@ -0,0 +1,100 @@
+import os
+import re
+import sqlite3
+import threading
+
+SEARCH_DATABASE = os.path.join("conversations", "archive", "search.db")
+
+# Markers around matched words in snippets, replaced by each front end's highlighting
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+class ConversationSearchIndex:
+    """Full-text index over archived conversation messages, using SQLite FTS5.
+
+    Messages are indexed one at a time as they are archived, so the index
+    never needs to be rebuilt.
+    """
+
+    def __init__(self, path=SEARCH_DATABASE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Opened on first use, so starting the CLI doesn't wait on SQLite
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+                    content,
+                    conversation_id UNINDEXED,
+                    turn UNINDEXED,
+                    role UNINDEXED,
+                    tokenize = 'porter unicode61',
+                    prefix = '2 3'
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def is_empty(self):
+        with self._lock:
+            return self._connection().execute("SELECT 1 FROM messages LIMIT 1").fetchone() is None
+
+    def add(self, conversation_id, turn, message):
+        """Index a single archived message."""
+        self.add_many([(conversation_id, turn, message)])
+
+    def add_many(self, entries):
+        """Index (conversation_id, turn, message) entries in one transaction."""
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT INTO messages (content, conversation_id, turn, role) VALUES (?, ?, ?, ?)",
+                [(message.get('content', ''), conversation_id, turn, message.get('role'))
+                 for conversation_id, turn, message in entries]
+            )
+            conn.commit()
+
+    def search(self, query, limit=20):
+        """Return the best matching messages with highlighted snippets.
+
+        Every word of the query must match; the last word also matches as a
+        prefix. Results are ranked by BM25.
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        # Quote each word so user input is never parsed as FTS5 syntax
+        match = " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+        with self._lock:
+            rows = self._connection().execute(
+                """
+                SELECT conversation_id, turn, role,
+                       snippet(messages, 0, ?, ?, '...', 16),
+                       bm25(messages)
+                FROM messages
+                WHERE messages MATCH ?
+                ORDER BY bm25(messages)
+                LIMIT ?
+                """,
+                (SNIPPET_START, SNIPPET_END, match.strip(), limit)
+            ).fetchall()
+        return [
+            {
+                'conversation_id': conversation_id,
+                'turn': turn,
+                'role': role,
+                'snippet': snippet,
+                'score': -rank,
+            }
+            for conversation_id, turn, role, snippet, rank in rows
+        ]
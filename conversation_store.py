@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Seconds between sweeps for idle conversations
+EXPIRE_INTERVAL = 600
+
+
+class ConversationStore:
+    """Server-side storage for conversation histories, keyed by an opaque session id.
+
+    Each conversation remembers when it was last read or written. With a ttl,
+    conversations idle for longer are deleted by a sweep that runs at most
+    every EXPIRE_INTERVAL seconds, as part of an append.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._next_expiry = 0.0
+
+    def maybe_expire(self, now):
+        """Delete idle conversations if a ttl is set and the last sweep was long enough ago."""
+        if not self.ttl or now < self._next_expiry:
+            return
+        self._next_expiry = now + EXPIRE_INTERVAL
+        self.expire(now - self.ttl)
+
+    def expire(self, before):
+        """Delete the conversations last used before the timestamp `before`, returning how many."""
+        raise NotImplementedError
+
+    def append(self, session_id, message):
+        """Append a single message to a conversation."""
+        raise NotImplementedError
+
+    def get_history(self, session_id, start=0):
+        """Return the messages of a conversation from index `start` on, oldest first."""
+        raise NotImplementedError
+
+    def clear(self, session_id):
+        """Remove all messages of a conversation."""
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Conversation store kept in process memory, for tests and single-process use."""
+
+    def __init__(self, ttl=None):
+        super().__init__(ttl)
+        self._conversations = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def append(self, session_id, message):
+        now = time.time()
+        self.maybe_expire(now)
+        with self._lock:
+            self._conversations.setdefault(session_id, []).append(dict(message))
+            self._last_used[session_id] = now
+
+    def get_history(self, session_id, start=0):
+        with self._lock:
+            if session_id in self._conversations:
+                self._last_used[session_id] = time.time()
+            return [dict(message) for message in self._conversations.get(session_id, [])[start:]]
+
+    def clear(self, session_id):
+        with self._lock:
+            self._conversations.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+
+    def expire(self, before):
+        with self._lock:
+            idle = [session_id for session_id, last_used in self._last_used.items() if last_used < before]
+            for session_id in idle:
+                del self._conversations[session_id]
+                del self._last_used[session_id]
+        return len(idle)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversation store backed by an embedded SQLite database.
+
+    Each turn is a single row insert, so appending never rewrites the history.
+    """
+
+    def __init__(self, path, ttl=None):
+        super().__init__(ttl)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+        # Conversations stored before sessions were tracked count as used now
+        self._conn.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, last_used) SELECT DISTINCT session_id, ? FROM messages",
+            (time.time(),)
+        )
+        self._conn.commit()
+
+    def _touch(self, session_id, now):
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, last_used) VALUES (?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET last_used = excluded.last_used",
+            (session_id, now)
+        )
+
+    def append(self, session_id, message):
+        now = time.time()
+        self.maybe_expire(now)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, data) VALUES (?, ?)",
+                (session_id, json.dumps(message, separators=(',', ':')))
+            )
+            self._touch(session_id, now)
+            self._conn.commit()
+
+    def get_history(self, session_id, start=0):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY id LIMIT -1 OFFSET ?",
+                (session_id, start)
+            ).fetchall()
+            if rows:
+                self._conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?",
+                                   (time.time(), session_id))
+                self._conn.commit()
+        return [json.loads(row[0]) for row in rows]
+
+    def clear(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def expire(self, before):
+        with self._lock:
+            idle = "SELECT session_id FROM sessions WHERE last_used < ?"
+            self._conn.execute(f"DELETE FROM messages WHERE session_id IN ({idle})", (before,))
+            deleted = self._conn.execute("DELETE FROM sessions WHERE last_used < ?", (before,)).rowcount
+            self._conn.commit()
+        return deleted
+
+
+def create_conversation_store(location, ttl=None):
+    """Create a conversation store from a location: 'memory' or a SQLite file path.
+
+    Conversations idle for more than ttl seconds are deleted; None keeps them forever.
+    """
+    if location == "memory":
+        return InMemoryConversationStore(ttl)
+    return SQLiteConversationStore(location, ttl)
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: processes sharing a cache directory aren't coordinated
+    fcntl = None
+
+DIGEST_SIZE = 32
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class _ModelStore:
+    """Append-only on-disk embeddings of one model.
+
+    vectors.f32 holds one float32 row per text and index.bin the sha256 digest
+    of each row's text, in the same order. Several processes may share a
+    store: appends take turns through a lock file, and digests appended by
+    other processes are read before looking a text up or adding one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = {}
+        self.dimensions = None
+        self._count = 0
+        self._vectors = None
+        self.refresh()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store for appending, against other processes."""
+        with open(self._file(".lock"), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Index the rows appended since the last call, by this or another process."""
+        if self.dimensions is None:
+            try:
+                with open(self._file("meta.json")) as f:
+                    self.dimensions = json.load(f)['dimensions']
+            except (OSError, ValueError):
+                return
+        try:
+            # Only rows whose vector and digest are both complete count
+            count = min(os.path.getsize(self._file("index.bin")) // DIGEST_SIZE,
+                        os.path.getsize(self._file("vectors.f32")) // (4 * self.dimensions))
+        except OSError:
+            return
+        if count <= self._count:
+            return
+        with open(self._file("index.bin"), 'rb') as f:
+            f.seek(self._count * DIGEST_SIZE)
+            digests = f.read((count - self._count) * DIGEST_SIZE)
+        for row in range(self._count, count):
+            offset = (row - self._count) * DIGEST_SIZE
+            self.rows.setdefault(digests[offset:offset + DIGEST_SIZE], row)
+        self._count = count
+
+    def _map_vectors(self):
+        if self._vectors is None or len(self._vectors) < self._count:
+            self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode='r',
+                                      shape=(self._count, self.dimensions))
+        return self._vectors
+
+    def get(self, digest):
+        row = self.rows.get(digest)
+        if row is None:
+            return None
+        return np.array(self._map_vectors()[row])
+
+    def append(self, digests, vectors):
+        """Store the vectors of texts not stored yet, by this or another process."""
+        with self._locked():
+            self.refresh()
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+                with open(self._file("meta.json"), 'w') as f:
+                    json.dump({'dimensions': self.dimensions}, f)
+            new = [(digest, vector) for digest, vector in zip(digests, vectors) if digest not in self.rows]
+            if not new:
+                return
+            row_size = 4 * self.dimensions
+            with open(self._file("vectors.f32"), 'ab') as vectors_file, \
+                    open(self._file("index.bin"), 'ab') as index_file:
+                # Drop what an interrupted append left of a row or digest, so both files line up again
+                count = min(os.fstat(vectors_file.fileno()).st_size // row_size,
+                            os.fstat(index_file.fileno()).st_size // DIGEST_SIZE)
+                vectors_file.truncate(count * row_size)
+                index_file.truncate(count * DIGEST_SIZE)
+                # Rows are written before their digests, so an interrupted append is never indexed
+                vectors_file.write(np.ascontiguousarray([vector for digest, vector in new], dtype=np.float32).tobytes())
+                vectors_file.flush()
+                index_file.write(b"".join(digest for digest, vector in new))
+            self.refresh()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache keyed by (model, sha256(text)).
+
+    Lookups go through an in-memory LRU first, then the on-disk store. All
+    misses of a call are embedded together in one call to the backend.
+    """
+
+    def __init__(self, directory, max_memory_entries=4096):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._stores = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, model):
+        store = self._stores.get(model)
+        if store is None:
+            safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model)
+            store = self._stores[model] = _ModelStore(os.path.join(self.directory, safe_name))
+        return store
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model, texts, embed):
+        """Return embeddings for texts, calling embed(model, missing_texts) for cache misses."""
+        digests = [text_digest(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()
+
+        with self._lock:
+            store = self._store(model)
+            store.refresh()
+            for i, digest in enumerate(digests):
+                key = (model, digest)
+                vector = self._memory.get(key)
+                if vector is None:
+                    vector = store.get(digest)
+                if vector is None:
+                    missing.setdefault(digest, []).append(i)
+                    continue
+                self._remember(key, vector)
+                vectors[i] = vector
+            self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+            self.misses += len(missing)
+
+        if missing:
+            missing_texts = [texts[positions[0]] for positions in missing.values()]
+            embedded = np.asarray(embed(model, missing_texts), dtype=np.float32).reshape(len(missing_texts), -1)
+            with self._lock:
+                store.append(list(missing), embedded)
+                for (digest, positions), vector in zip(missing.items(), embedded):
+                    self._remember((model, digest), vector)
+                    for i in positions:
+                        vectors[i] = vector
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors).astype(np.float32, copy=False)
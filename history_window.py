@@ -0,0 +1,105 @@
+# Rough characters-per-token ratio of the Llama-family tokenizers on English text
+CHARS_PER_TOKEN = 4
+
+# Per-message overhead of the chat template (role markers, separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Tokens kept free in the context window for the model's reply
+RESPONSE_TOKEN_RESERVE = 512
+
+# When the history outgrows its budget, old messages are dropped until it fills
+# no more than this share of the budget. The window start then stays put for
+# several turns, and with it the prompt prefix Ollama can reuse from its cache.
+WINDOW_LOW_WATER = 0.5
+
+
+def count_tokens(text):
+    """Estimate the number of tokens a piece of text takes in the prompt."""
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_TOKEN_OVERHEAD
+
+
+def with_token_count(message):
+    """Return the message with its token count cached under 'tokens'."""
+    if 'tokens' not in message:
+        message = dict(message)
+        message['tokens'] = count_tokens(message.get('content', ''))
+    return message
+
+
+def message_tokens(message):
+    return message['tokens'] if 'tokens' in message else count_tokens(message.get('content', ''))
+
+
+def history_budget(num_ctx, system_prompt=None, reserve=RESPONSE_TOKEN_RESERVE):
+    """Tokens of the context window left for the conversation history."""
+    budget = num_ctx - min(reserve, num_ctx // 4)
+    if system_prompt:
+        budget -= count_tokens(system_prompt)
+    return budget
+
+
+def window_history(conversation_history, num_ctx, system_prompt=None, reserve=RESPONSE_TOKEN_RESERVE):
+    """Select the recent messages that fit in the model's context window.
+
+    The budget is num_ctx minus the tokens reserved for the response and the
+    system prompt. Rather than sliding by a message every turn, the window
+    start is replayed over the history: whenever the messages since the start
+    outgrow the budget, it jumps ahead until they fill WINDOW_LOW_WATER of
+    it. Between jumps every turn sends the same leading messages, so Ollama
+    only evaluates the new ones. Token counts cached by with_token_count()
+    are used. The latest message is always kept, and the window never starts
+    with an assistant reply.
+    """
+    if not num_ctx or num_ctx <= 0:
+        # Let Ollama apply its own default context length
+        return [strip_message(message) for message in conversation_history]
+
+    budget = history_budget(num_ctx, system_prompt, reserve)
+
+    start = 0
+    used = 0
+    for end, message in enumerate(conversation_history):
+        used += message_tokens(message)
+        if used > budget:
+            while start < end and (used > budget * WINDOW_LOW_WATER
+                                   or conversation_history[start].get('role') == 'assistant'):
+                used -= message_tokens(conversation_history[start])
+                start += 1
+
+    return [strip_message(message) for message in conversation_history[start:]]
+
+
+def assemble_prompt(conversation_history, num_ctx, system_prompt=None, context_message=None,
+                    summary_message=None):
+    """Build the messages for the next reply with a prefix that is stable across turns.
+
+    The system prompt comes first as a system message, then the summary of
+    compacted turns if there is one, then the windowed history, so
+    consecutive turns share a byte-identical prefix up to the previous reply.
+    A context_message that changes with every turn, such as retrieved
+    training content, goes right before the latest message, where it doesn't
+    disturb that prefix.
+    """
+    window_system = system_prompt
+    for extra in (summary_message, context_message):
+        if extra is not None:
+            window_system = (window_system or "") + "\n" + extra['content']
+    messages = window_history(conversation_history, num_ctx, window_system)
+
+    if context_message is not None:
+        messages.insert(max(0, len(messages) - 1), strip_message(context_message))
+    if summary_message is not None:
+        messages.insert(0, strip_message(summary_message))
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    return messages
+
+
+def prompt_tokens(messages):
+    """Estimate the number of prompt tokens of a list of chat messages."""
+    return sum(count_tokens(message['content']) for message in messages)
+
+
+def strip_message(message):
+    """Return only the fields Ollama expects in a chat message."""
+    return {"role": message['role'], "content": message['content']}
@@ -0,0 +1,217 @@
+import os
+import io
+import re
+import gzip
+import json
+import time
+import hashlib
+import unicodedata
+from retrieval import INDEX_DIRECTORY, CHUNK_SIZE, split_long, chunk_paragraphs, build_index
+
+# Uploaded files wait here until their training job has ingested them
+UPLOAD_DIRECTORY = os.path.join(INDEX_DIRECTORY, "uploads")
+
+# Bytes copied per read when an upload is saved
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.markdown')
+JSONL_EXTENSIONS = ('.jsonl',)
+
+# Longest piece of a line read at once, and longest paragraph collected before it is passed on
+MAX_LINE_SIZE = 64 * 1024
+MAX_PARAGRAPH_SIZE = 256 * 1024
+
+# Fields of a JSONL record whose text is ingested, in this order, besides the contents of 'messages'
+JSONL_TEXT_FIELDS = ('title', 'text', 'content', 'body', 'prompt', 'response', 'completion')
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Control characters other than tab and newline, and byte order marks
+CONTROL_CHARACTERS = re.compile(r'[\x00-\x08\x0b-\x1f\x7f\ufeff]')
+
+BLANK_LINE = re.compile(r'\n[ \t]*\n')
+
+MB = 1024 * 1024
+
+
+def upload_format(filename):
+    """'jsonl' or 'text' for a supported file name, which may end in .gz; raises ValueError otherwise."""
+    name = (filename or '').lower()
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    if name.endswith(JSONL_EXTENSIONS):
+        return 'jsonl'
+    if name.endswith(TEXT_EXTENSIONS):
+        return 'text'
+    raise ValueError(f"Unsupported file type: {filename}. Upload .txt, .md or .jsonl files, optionally gzipped.")
+
+
+def save_upload(stream, path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Copy an uploaded file to path chunk by chunk and return its size in bytes."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    size = 0
+    with open(path, 'wb') as f:
+        while True:
+            block = stream.read(chunk_size)
+            if not block:
+                return size
+            f.write(block)
+            size += len(block)
+
+
+def normalize_text(text):
+    """NFC-normalize text and drop control characters and trailing whitespace on each line."""
+    text = CONTROL_CHARACTERS.sub('', unicodedata.normalize('NFC', text))
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def content_hash(paragraph):
+    """64-bit hash of a paragraph that ignores differences in whitespace."""
+    digest = hashlib.blake2b(" ".join(paragraph.split()).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def record_text(record):
+    """The text of a JSONL record: its text fields and message contents, or the record itself if it is a string."""
+    if isinstance(record, str):
+        return record
+    if not isinstance(record, dict):
+        return ""
+    parts = [record[field] for field in JSONL_TEXT_FIELDS if isinstance(record.get(field), str)]
+    for message in record.get('messages') or []:
+        if isinstance(message, dict) and isinstance(message.get('content'), str):
+            parts.append(message['content'])
+    return "\n\n".join(parts)
+
+
+class Ingestion:
+    """Streams an uploaded corpus into a model's training content and vector index.
+
+    The upload is read through a chain of generators: it is gunzipped if
+    needed and decoded, split into paragraphs, normalized, stripped of
+    paragraphs already seen (by content hash), and grouped into chunks that
+    are embedded batch by batch. Memory use doesn't grow with the size of the
+    upload, apart from one 64-bit hash per distinct paragraph. The
+    deduplicated text is written to the content file as it goes by.
+    """
+
+    def __init__(self, path, filename, progress=None):
+        self.path = path
+        self.format = upload_format(filename)
+        self.size = os.path.getsize(path)
+        self.progress = progress
+        self.bytes_read = 0
+        self.paragraphs = 0
+        self.duplicates = 0
+        self.invalid_records = 0
+        self.chunks = 0
+        self.started = None
+        self.finished = None
+        self._seen = set()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def mb_per_second(self):
+        return self.bytes_read / MB / self.elapsed if self.elapsed else 0.0
+
+    def open(self, raw):
+        """A text stream of the upload, gunzipped if it is compressed."""
+        compressed = raw.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+        raw.seek(0)
+        binary = gzip.GzipFile(fileobj=raw, mode='rb') if compressed else raw
+        return io.TextIOWrapper(binary, encoding='utf-8', errors='replace')
+
+    def text_paragraphs(self, f):
+        """Yield the paragraphs of plain text, read line by line."""
+        lines = []
+        size = 0
+        while True:
+            line = f.readline(MAX_LINE_SIZE)
+            if not line or not line.strip():
+                if lines:
+                    yield "".join(lines)
+                    lines, size = [], 0
+                if not line:
+                    return
+                continue
+            lines.append(line)
+            size += len(line)
+            if size >= MAX_PARAGRAPH_SIZE:
+                # A paragraph this long is split into chunk-sized pieces anyway
+                yield "".join(lines)
+                lines, size = [], 0
+
+    def jsonl_paragraphs(self, f):
+        """Yield the paragraphs of the text of each JSONL record."""
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.invalid_records += 1
+                continue
+            yield from BLANK_LINE.split(record_text(record))
+
+    def unique_paragraphs(self, paragraphs):
+        """Normalize paragraphs and drop empty ones and those seen before."""
+        for paragraph in paragraphs:
+            paragraph = normalize_text(paragraph)
+            if not paragraph:
+                continue
+            key = content_hash(paragraph)
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(key)
+            self.paragraphs += 1
+            yield paragraph
+
+    def positioned(self, paragraphs, content):
+        """Write paragraphs to the content file and yield (position, piece) pairs of at most CHUNK_SIZE."""
+        position = 0
+        for paragraph in paragraphs:
+            if position:
+                content.write("\n\n")
+                position += 2
+            content.write(paragraph)
+            yield from split_long(position, paragraph, CHUNK_SIZE)
+            position += len(paragraph)
+
+    def counted(self, chunks):
+        for chunk in chunks:
+            self.chunks += 1
+            yield chunk
+
+    def run(self, model_name, content_path):
+        """Ingest the upload into content_path and the model's vector index, and return a summary."""
+        self.started = time.perf_counter()
+        with open(self.path, 'rb') as raw, open(content_path, 'w', encoding='utf-8') as content:
+            text = self.open(raw)
+            paragraphs = self.jsonl_paragraphs(text) if self.format == 'jsonl' else self.text_paragraphs(text)
+            chunks = chunk_paragraphs(self.positioned(self.unique_paragraphs(paragraphs), content))
+
+            def indexing_progress(completed, total):
+                # Bytes of the file as uploaded, before decompression
+                self.bytes_read = raw.tell()
+                if self.progress:
+                    self.progress(self)
+
+            build_index(model_name, self.counted(chunks), indexing_progress)
+            self.bytes_read = self.size
+        self.finished = time.perf_counter()
+        return self.summary()
+
+    def summary(self):
+        summary = (f"Ingested {self.bytes_read / MB:.1f} MB in {self.elapsed:.1f}s ({self.mb_per_second:.1f} MB/s): "
+                   f"{self.paragraphs} paragraphs in {self.chunks} chunks, {self.duplicates} duplicate paragraphs skipped")
+        if self.invalid_records:
+            summary += f", {self.invalid_records} invalid JSONL lines skipped"
+        return summary
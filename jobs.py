@@ -0,0 +1,170 @@
+import time
+import uuid
+import queue
+import threading
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted to a runner whose queue is full."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once its cancellation has been requested."""
+
+
+class Job:
+    """A unit of background work and its progress."""
+
+    def __init__(self, kind, key, target, args):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.target = target
+        self.args = args
+        self.status = QUEUED
+        self.message = ""
+        self.completed = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def update(self, message=None, completed=None, total=None):
+        """Record progress reported by the running job."""
+        if message is not None:
+            self.message = message
+        if completed is not None:
+            self.completed = completed
+        if total is not None:
+            self.total = total
+
+    def check_cancelled(self):
+        """Stop the running job if cancellation was requested."""
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        """Return the job status as a JSON-serializable dictionary."""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'key': self.key,
+            'status': self.status,
+            'message': self.message,
+            'completed': self.completed,
+            'total': self.total,
+            'percentage': (self.completed / self.total) * 100 if self.total else None,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobRunner:
+    """A pool of worker threads fed by a bounded queue of jobs.
+
+    Jobs are deduplicated by (kind, key): submitting work for a key that
+    already has a queued or running job returns the existing job.
+    """
+
+    def __init__(self, workers=2, max_queue=32, keep_finished=100):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+        self._finished = []
+        self._keep_finished = keep_finished
+        self._threads = []
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, key, target, *args):
+        """Queue target(job, *args) to run in the background and return its job."""
+        with self._lock:
+            existing = self._active.get((kind, key))
+            if existing is not None:
+                return existing
+
+            job = Job(kind, key, target, args)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"Too many queued {kind} jobs, try again later")
+            self._jobs[job.id] = job
+            self._active[(kind, key)] = job
+            self._start_workers()
+        return job
+
+    def get(self, job_id):
+        """Return a job by id, or None if it is unknown or has expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, kind, key):
+        """Return the queued or running job for a key, if any."""
+        with self._lock:
+            return self._active.get((kind, key))
+
+    def cancel(self, job_id):
+        """Request cancellation of a job; queued jobs never start."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        return True
+
+    def _finish(self, job, status):
+        with self._lock:
+            job.status = status
+            job.finished_at = time.time()
+            if self._active.get((job.kind, job.key)) is job:
+                del self._active[(job.kind, job.key)]
+            # Only remember a bounded number of finished jobs
+            self._finished.append(job.id)
+            while len(self._finished) > self._keep_finished:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancel_requested.is_set():
+                    self._finish(job, CANCELLED)
+                    continue
+
+                job.status = RUNNING
+                job.started_at = time.time()
+                try:
+                    job.result = job.target(job, *job.args)
+                except JobCancelled:
+                    self._finish(job, CANCELLED)
+                except Exception as e:
+                    job.error = str(e)
+                    self._finish(job, FAILED)
+                else:
+                    self._finish(job, COMPLETED)
+            finally:
+                self._queue.task_done()
@@ -1,21 +1,30 @@
 #!/usr/bin/env python3
 
-import os
-import json
+import argparse
 import time
-import subprocess
-from datetime import datetime
-import ollama
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
-from rich.markdown import Markdown
-from rich import print as rprint
-from pyfiglet import Figlet
+from rich.markup import escape
+from model_registry import registry
+from backend_pool import pool
+from response_cache import response_cache
+from history_window import with_token_count, assemble_prompt, prompt_tokens, strip_message
+from conversation_archive import ConversationArchive
+import metrics
+from conversation_search import ConversationSearchIndex, SNIPPET_START, SNIPPET_END
+from model_residency import ModelResidency
+from batch import run_batch, DEFAULT_CONCURRENCY as DEFAULT_BATCH_CONCURRENCY
+from ollama_probe import probe
+from compaction import ConversationCompactor
+from profiler import profiler, option_grid, format_options, DEFAULT_RUNS as DEFAULT_PROFILE_RUNS
 
 # Initialize console
 console = Console()
 
+# Saved conversations
+conversation_archive = ConversationArchive(search_index=ConversationSearchIndex())
+
 # Model configuration
 MODEL_OPTIONS = {
     "tinyllama": {
@@ -45,28 +54,35 @@ DEFAULT_MODEL = "tinyllama"
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_CONTEXT_LENGTH = 2048
 
+# Keeps the chosen model loaded in Ollama between turns
+residency = ModelResidency(MODEL_OPTIONS)
+
+# Summarizes the oldest turns of long conversations in the background
+compactor = ConversationCompactor()
+
+# Pre-rendered with pyfiglet's slant font (pyfiglet -f slant "Ollama Studies"), so
+# starting up doesn't load font files to draw the same text every time
+HEADER_BANNER = r"""
+   ____  ____                         _____ __            ___
+  / __ \/ / /___ _____ ___  ____ _   / ___// /___  ______/ (_)__  _____
+ / / / / / / __ `/ __ `__ \/ __ `/   \__ \/ __/ / / / __  / / _ \/ ___/
+/ /_/ / / / /_/ / / / / / / /_/ /   ___/ / /_/ /_/ / /_/ / /  __(__  )
+\____/_/_/\__,_/_/ /_/ /_/\__,_/   /____/\__/\__,_/\__,_/_/\___/____/
+"""[1:]
+
 def clear_screen():
     """Clear the terminal screen."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    console.clear()
 
 def display_header():
     """Display application header."""
     clear_screen()
-    f = Figlet(font='slant')
-    header_text = f.renderText('Ollama Studies')
-    console.print(f"[bold cyan]{header_text}[/bold cyan]")
+    console.print(f"[bold cyan]{HEADER_BANNER}[/bold cyan]")
     console.print("[bold yellow]Interact with Llama 2 7B locally using Ollama[/bold yellow]\n")
 
 def check_ollama_installed():
-    """Check if Ollama is installed on the system."""
-    try:
-        result = subprocess.run(['which', 'ollama'], 
-                              stdout=subprocess.PIPE, 
-                              stderr=subprocess.PIPE, 
-                              text=True)
-        return result.returncode == 0
-    except:
-        return False
+    """Check if Ollama is installed on the system, or its daemon is reachable."""
+    return probe.is_installed()
 
 def install_ollama():
     """Show instructions for installing Ollama on macOS."""
@@ -91,11 +107,7 @@ Once Ollama is running, restart this script.
 def check_model_exists(model_name):
     """Check if the specified model is already pulled."""
     try:
-        models = ollama.list()
-        for model in models['models']:
-            if model['name'] == model_name:
-                return True
-        return False
+        return registry.exists(model_name)
     except Exception as e:
         console.print(f"[bold red]Error checking models: {e}[/bold red]")
         return False
@@ -105,21 +117,25 @@ def pull_model(model_name):
     console.print(f"[bold yellow]Pulling {model_name} model... This may take a while.[/bold yellow]")
     try:
         # Stream progress to console
-        for progress in ollama.pull(model_name, stream=True):
+        for progress in pool.pull(model_name, stream=True):
             if 'completed' in progress and 'total' in progress:
                 percentage = (progress['completed'] / progress['total']) * 100
                 console.print(f"Download progress: [bold green]{percentage:.2f}%[/bold green]", end="\r")
+        registry.invalidate()
         console.print(f"\n[bold green]{model_name} model pulled successfully![/bold green]")
         return True
     except Exception as e:
         console.print(f"[bold red]Error pulling model: {e}[/bold red]")
         return False
 
-def get_conversation_settings():
-    """Get conversation settings from user."""
+def get_conversation_settings(model_name=None):
+    """Get conversation settings from user, defaulting to the model's fastest profiled options."""
     console.print("\n[bold]Conversation Settings[/bold]")
     console.rule()
     
+    best_options = profiler.best_options(model_name) if model_name else {}
+    default_context_length = best_options.pop('num_ctx', DEFAULT_CONTEXT_LENGTH)
+    
     temperature = Prompt.ask(
         "Temperature (0.0-1.0, higher = more creative)", 
         default=str(DEFAULT_TEMPERATURE)
@@ -133,13 +149,13 @@ def get_conversation_settings():
     
     context_length = Prompt.ask(
         "Context length (tokens to remember)", 
-        default=str(DEFAULT_CONTEXT_LENGTH)
+        default=str(default_context_length)
     )
     try:
         context_length = int(context_length)
         context_length = max(0, min(8192, context_length))  # Set reasonable limits
     except ValueError:
-        context_length = DEFAULT_CONTEXT_LENGTH
+        context_length = default_context_length
         console.print(f"[yellow]Invalid input, using default context length: {context_length}[/yellow]")
     
     system_prompt = Prompt.ask(
@@ -147,37 +163,87 @@ def get_conversation_settings():
         default="You are a helpful AI assistant. Respond concisely and accurately."
     )
     
+    # num_thread and num_batch as measured by `main.py profile`
     return {
         "temperature": temperature,
         "num_ctx": context_length,
-        "system": system_prompt
+        "system": system_prompt,
+        **best_options
     }
 
-def save_conversation(conversation_history):
-    """Save the conversation history to a file."""
+def save_conversation(conversation_history, archive_state=None, model=None):
+    """Save the conversation to the archive, appending only turns not saved yet."""
     if not conversation_history:
         console.print("[yellow]No conversation to save.[/yellow]")
         return
     
-    # Create conversations directory if it doesn't exist
-    os.makedirs("conversations", exist_ok=True)
+    if archive_state is None:
+        archive_state = {}
+    
+    conversation_id, archived_turns = conversation_archive.save(
+        [strip_message(message) for message in conversation_history],
+        model=model,
+        conversation_id=archive_state.get('id'),
+        archived_turns=archive_state.get('turns', 0)
+    )
+    archive_state['id'] = conversation_id
+    archive_state['turns'] = archived_turns
     
-    # Generate filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"conversations/conversation_{timestamp}.json"
+    console.print(f"[bold green]Conversation saved as {conversation_id}[/bold green]")
+
+def list_conversations(conversation_id=None):
+    """List saved conversations, or print a single one."""
+    imported = conversation_archive.import_json_files()
+    if imported:
+        console.print(f"[dim]Imported {imported} conversation file(s) into the archive.[/dim]")
     
-    with open(filename, 'w') as file:
-        json.dump(conversation_history, file, indent=2)
+    if conversation_id:
+        conversation = conversation_archive.get(conversation_id)
+        if conversation is None:
+            console.print(f"[bold red]Conversation {conversation_id} not found.[/bold red]")
+            return
+        console.print(f"[bold]{conversation['started_at']}[/bold] [dim]{conversation['model'] or 'Unknown model'}[/dim]")
+        console.rule()
+        for message in conversation_archive.load(conversation_id):
+            if message['role'] == 'user':
+                console.print(f"[bold cyan]USER>[/bold cyan] {message['content']}")
+            else:
+                console.print(f"[bold purple]LLM>[/bold purple] {message['content']}")
+        return
     
-    console.print(f"[bold green]Conversation saved to {filename}[/bold green]")
+    conversations = conversation_archive.list_conversations()
+    if not conversations:
+        console.print("[yellow]No saved conversations.[/yellow]")
+        return
+    for conversation in conversations:
+        console.print(f"[bold cyan]{conversation['id']}[/bold cyan]  {conversation['started_at']}  "
+                      f"{conversation['model'] or 'Unknown model'}  [dim]{conversation['turn_count']} messages[/dim]")
+
+def search_conversations(query):
+    """Print saved messages matching the query, best matches first."""
+    conversation_archive.import_json_files()
+    results = conversation_archive.search_index.search(query)
+    if not results:
+        console.print(f"[yellow]No messages match '{escape(query)}'.[/yellow]")
+        return
+    for result in results:
+        snippet = escape(result['snippet']).replace(SNIPPET_START, "[bold yellow]").replace(SNIPPET_END, "[/bold yellow]")
+        role = "USER" if result['role'] == 'user' else "LLM"
+        console.print(f"[bold cyan]{result['conversation_id']}[/bold cyan] [dim]{role}[/dim] {snippet}")
 
-def chat_with_model(settings):
+def chat_with_model(settings, archive_state=None, show_stats=False):
     """Start a conversation with the selected model."""
     conversation_history = []
     model_name = settings['model']
+    # The system prompt is sent as the leading message, not as an option
+    options = {key: value for key, value in settings.items() if key not in ('model', 'system')}
+    if archive_state is None:
+        archive_state = {}
     
     console.print(f"\n[bold green]Starting conversation with {model_name}. Type 'exit' to end.[/bold green]")
     console.print("[bold green]Type 'save' to save the conversation history.[/bold green]")
+    console.print("[bold green]Type 'search <words>' to search saved conversations.[/bold green]")
+    console.print("[bold green]Type 'stats' to toggle per-turn timing statistics.[/bold green]")
     console.rule()
     
     console.print(f"[dim]System: {settings['system']}[/dim]\n")
@@ -189,38 +255,67 @@ def chat_with_model(settings):
         # Check for exit command
         if user_input.lower() == 'exit':
             if Confirm.ask("Do you want to save this conversation before exiting?"):
-                save_conversation(conversation_history)
+                save_conversation(conversation_history, archive_state, model_name)
             break
         
         # Check for save command
         if user_input.lower() == 'save':
-            save_conversation(conversation_history)
+            save_conversation(conversation_history, archive_state, model_name)
+            continue
+        
+        # Check for stats command
+        if user_input.lower() == 'stats':
+            show_stats = not show_stats
+            console.print(f"[dim]Timing statistics {'on' if show_stats else 'off'}.[/dim]")
+            continue
+        
+        # Check for search command
+        if user_input.lower().startswith('search '):
+            search_conversations(user_input[len('search '):])
             continue
         
         # Add user message to history
-        conversation_history.append({"role": "user", "content": user_input})
+        conversation_history.append(with_token_count({"role": "user", "content": user_input}))
         
         # Get response from model
         try:
             console.print("[bold purple]LLM>[/bold purple] ", end="")
             response_text = ""
+            stats = {}
+            ttft = None
+            chat_started = time.perf_counter()
             
             # Stream the response
-            for chunk in ollama.chat(
+            residency.touch(model_name)
+            summary_message, recent_history = compactor.compacted(id(conversation_history), conversation_history)
+            messages = assemble_prompt(recent_history, settings['num_ctx'], settings['system'],
+                                       summary_message=summary_message)
+            for chunk in response_cache.chat(
                 model=model_name,
-                messages=conversation_history,
+                messages=messages,
                 stream=True,
-                options=settings
+                options=options,
+                keep_alive=residency.keep_alive_for(model_name)
             ):
                 if 'message' in chunk and 'content' in chunk['message']:
                     content_chunk = chunk['message']['content']
+                    if ttft is None and content_chunk:
+                        ttft = time.perf_counter() - chat_started
                     response_text += content_chunk
                     console.print(content_chunk, end="")
+                if chunk.get('done'):
+                    stats = metrics.observe_response(model_name, chunk, ttft, prompt_tokens(messages))
             
             console.print()  # New line after response
+            if show_stats and stats:
+                console.print(f"[dim]{metrics.format_stats(stats)}[/dim]")
             
             # Add assistant response to history
-            conversation_history.append({"role": "assistant", "content": response_text})
+            conversation_history.append(with_token_count({"role": "assistant", "content": response_text}))
+            
+            # Summarize the oldest turns while the user types, once the conversation grows long
+            compactor.maybe_compact(id(conversation_history), conversation_history, settings['num_ctx'],
+                                    settings['system'])
             
         except Exception as e:
             console.print(f"[bold red]Error: {e}[/bold red]")
@@ -234,29 +329,36 @@ def select_model():
     
     console.print("[yellow]Choose a model based on your hardware capabilities:[/yellow]\n")
     
+    # Default to the model measured fastest on this machine by `main.py profile`
+    models = list(MODEL_OPTIONS.values())
+    fastest = profiler.fastest([model['name'] for model in models])
+    default_choice = next((i for i, model in enumerate(models, 1) if model['name'] == fastest), 1)
+    
     # Display model options
-    for i, (key, model) in enumerate(MODEL_OPTIONS.items(), 1):
-        console.print(f"[bold cyan]{i}.[/bold cyan] [bold]{model['name']}[/bold]")
+    for i, model in enumerate(models, 1):
+        throughput = profiler.throughput(model['name'])
+        measured = f" [green]({throughput:.1f} tokens/s measured)[/green]" if throughput else ""
+        console.print(f"[bold cyan]{i}.[/bold cyan] [bold]{model['name']}[/bold]{measured}")
         console.print(f"   {model['description']}")
     
     # Get user choice
     choice = 0
-    while choice < 1 or choice > len(MODEL_OPTIONS):
+    while choice < 1 or choice > len(models):
         try:
-            choice_input = Prompt.ask("\nSelect a model (1-5)", default="1")
+            choice_input = Prompt.ask(f"\nSelect a model (1-{len(models)})", default=str(default_choice))
             choice = int(choice_input)
-            if choice < 1 or choice > len(MODEL_OPTIONS):
-                console.print("[red]Invalid choice. Please select a number between 1 and 5.[/red]")
+            if choice < 1 or choice > len(models):
+                console.print(f"[red]Invalid choice. Please select a number between 1 and {len(models)}.[/red]")
         except ValueError:
             console.print("[red]Please enter a valid number.[/red]")
     
     # Get the selected model
-    selected_model = list(MODEL_OPTIONS.values())[choice-1]['name']
+    selected_model = models[choice-1]['name']
     console.print(f"\n[bold green]Selected model: {selected_model}[/bold green]")
     
     return selected_model
 
-def main_menu():
+def main_menu(show_stats=False):
     """Display the main menu and handle user selection."""
     display_header()
     
@@ -287,22 +389,117 @@ def main_menu():
     else:
         console.print(f"[bold green]{selected_model} model is already downloaded.[/bold green]")
     
+    # Load the model while the user fills in the conversation settings
+    residency.preload(selected_model)
+    
     # Get conversation settings
-    settings = get_conversation_settings()
+    settings = get_conversation_settings(selected_model)
     settings['model'] = selected_model
     
     # Start conversation
-    conversation_history = chat_with_model(settings)
+    archive_state = {}
+    conversation_history = chat_with_model(settings, archive_state, show_stats)
     
     # Ask to save if not already saved
-    if conversation_history and Confirm.ask("Do you want to save this conversation?"):
-        save_conversation(conversation_history)
+    if conversation_history and archive_state.get('turns') != len(conversation_history) \
+            and Confirm.ask("Do you want to save this conversation?"):
+        save_conversation(conversation_history, archive_state, selected_model)
     
     console.print("[bold yellow]Thank you for using Ollama Studies![/bold yellow]")
 
+def batch_mode(args):
+    """Run a JSONL file of prompts and report progress on the console."""
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+    options = {"temperature": args.temperature, "num_ctx": args.context_length}
+    started = time.perf_counter()
+    
+    def progress(counts):
+        console.print(f"[dim]{counts['succeeded']} done, {counts['failed']} failed, "
+                      f"{counts['skipped']} already in output[/dim]", end="\r")
+    
+    counts = run_batch(args.input, args.output, models, args.concurrency, options, args.system, progress)
+    console.print(f"\n[bold green]Finished in {time.perf_counter() - started:.1f}s: {counts['succeeded']} succeeded, "
+                  f"{counts['failed']} failed, {counts['skipped']} skipped.[/bold green]")
+
+def profile_mode(args):
+    """Measure each local model across a grid of options and save the profile for this machine."""
+    if args.models:
+        models = [model.strip() for model in args.models.split(",") if model.strip()]
+    else:
+        models = registry.names()
+    grid = option_grid(args.num_ctx, args.num_thread, args.num_batch)
+    console.print(f"[bold]Profiling {len(models)} models with {len(grid)} option sets each "
+                  f"({args.runs} runs per set) on {profiler.machine}[/bold]")
+    
+    def progress(model_name, result):
+        if result.get('error'):
+            console.print(f"  [red]{model_name} {format_options(result['options'])}: {result['error']}[/red]")
+            return
+        memory = f"{result['memory_bytes'] / 1024 ** 2:.0f} MiB" if result.get('memory_bytes') else "unknown"
+        fits = "" if profiler.fits(result) else " [yellow](doesn't fit in RAM)[/yellow]"
+        console.print(f"  {model_name} {format_options(result['options'])}: "
+                      f"{result['tokens_per_second'] or 0:.1f} tokens/s, TTFT {result['ttft_ms'] or 0:.0f} ms, "
+                      f"memory {memory}{fits}")
+    
+    for model_name in models:
+        console.print(f"\n[bold cyan]{model_name}[/bold cyan]")
+        profiler.profile(model_name, grid, args.runs, progress)
+        best = profiler.best(model_name)
+        if best is not None:
+            console.print(f"[bold green]Fastest that fits: {format_options(best['options'])} "
+                          f"at {best['tokens_per_second']:.1f} tokens/s[/bold green]")
+        else:
+            console.print("[yellow]No option set could be measured.[/yellow]")
+    console.print(f"\n[dim]Saved to {profiler.path}[/dim]")
+
+def int_list(value):
+    """Parse a comma-separated list of integers; 'auto' leaves the option to Ollama."""
+    return [None if item.strip() == "auto" else int(item) for item in value.split(",") if item.strip()]
+
+def parse_args(argv=None):
+    """Parse the command line; without a command the interactive menu runs."""
+    parser = argparse.ArgumentParser(description="Interact with AI models locally using Ollama.")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    parser.add_argument("--stats", action="store_true", help="Show timing statistics after each reply")
+    
+    conversations_parser = subparsers.add_parser("conversations", help="List saved conversations or show one")
+    conversations_parser.add_argument("conversation_id", nargs="?", help="Conversation to show")
+    
+    batch_parser = subparsers.add_parser("batch", help="Run prompts from a JSONL file without interaction")
+    batch_parser.add_argument("--input", required=True, help="JSONL file with one prompt per line")
+    batch_parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    batch_parser.add_argument("--models", default=DEFAULT_MODEL,
+                              help=f"Comma-separated models to run each prompt on (default {DEFAULT_MODEL})")
+    batch_parser.add_argument("--concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                              help=f"Prompts in flight at once (default {DEFAULT_BATCH_CONCURRENCY})")
+    batch_parser.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE)
+    batch_parser.add_argument("--context-length", type=int, default=DEFAULT_CONTEXT_LENGTH)
+    batch_parser.add_argument("--system", help="System prompt for records that don't set one")
+    
+    profile_parser = subparsers.add_parser("profile", help="Measure each local model's throughput across option sets")
+    profile_parser.add_argument("--models", help="Comma-separated models to profile (default every local model)")
+    profile_parser.add_argument("--num-ctx", type=int_list, help="Comma-separated context lengths (default 2048,4096)")
+    profile_parser.add_argument("--num-thread", type=int_list,
+                                help="Comma-separated thread counts, 'auto' for Ollama's choice "
+                                     "(default auto, half and all of the cores)")
+    profile_parser.add_argument("--num-batch", type=int_list, help="Comma-separated batch sizes (default 256,512)")
+    profile_parser.add_argument("--runs", type=int, default=DEFAULT_PROFILE_RUNS,
+                                help=f"Measured runs per option set (default {DEFAULT_PROFILE_RUNS})")
+    
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main_menu()
+        if args.command == "conversations":
+            list_conversations(args.conversation_id)
+        elif args.command == "batch":
+            batch_mode(args)
+        elif args.command == "profile":
+            profile_mode(args)
+        else:
+            main_menu(show_stats=args.stats)
     except KeyboardInterrupt:
         console.print("\n[bold yellow]Program interrupted. Exiting...[/bold yellow]")
     except Exception as e:
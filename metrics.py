@@ -0,0 +1,243 @@
+import threading
+
+# Histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (1, 8, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+
+NANOSECONDS = 1e9
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """A Prometheus-style histogram with labels."""
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def totals(self):
+        """Sum and count of the observations across all label values."""
+        with self._lock:
+            return (sum(series['sum'] for series in self._series.values()),
+                    sum(series['count'] for series in self._series.values()))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, dict(series, counts=list(series['counts'])))
+                                  for key, series in self._series.items())
+        for key, series in series_items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """A Prometheus-style gauge with labels."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(list(zip(self.labelnames, key)))} {format_value(value)}")
+        return lines
+
+
+class Counter(Gauge):
+    """A Prometheus-style counter with labels; only ever incremented."""
+
+    metric_type = "counter"
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help_text, labelnames, buckets=DURATION_BUCKETS):
+        histogram = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def gauge(self, name, help_text, labelnames):
+        gauge = Gauge(name, help_text, labelnames)
+        self._metrics.append(gauge)
+        return gauge
+
+    def counter(self, name, help_text, labelnames):
+        counter = Counter(name, help_text, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+total_duration = registry.histogram(
+    "ollama_total_duration_seconds", "Total time Ollama spent on a generation.", ["model"])
+load_duration = registry.histogram(
+    "ollama_load_duration_seconds", "Time Ollama spent loading the model.", ["model"])
+prompt_eval_count = registry.histogram(
+    "ollama_prompt_eval_tokens", "Prompt tokens evaluated per generation.", ["model"], TOKEN_BUCKETS)
+prompt_eval_duration = registry.histogram(
+    "ollama_prompt_eval_duration_seconds", "Time Ollama spent evaluating the prompt.", ["model"])
+eval_count = registry.histogram(
+    "ollama_eval_tokens", "Tokens generated per response.", ["model"], TOKEN_BUCKETS)
+eval_duration = registry.histogram(
+    "ollama_eval_duration_seconds", "Time Ollama spent generating the response.", ["model"])
+eval_rate = registry.histogram(
+    "ollama_eval_tokens_per_second", "Generation speed in tokens per second.", ["model"], RATE_BUCKETS)
+prompt_reuse = registry.histogram(
+    "ollama_prompt_reuse_ratio", "Share of the prompt Ollama did not have to evaluate, per generation.",
+    ["model"], RATIO_BUCKETS)
+time_to_first_token = registry.histogram(
+    "ollama_time_to_first_token_seconds", "Wall-clock time from sending a chat request to its first token.", ["model"])
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Wall-clock duration of web requests.", ["route", "method", "status"])
+response_cache_requests = registry.counter(
+    "response_cache_requests_total", "Cacheable chat requests, by whether the reply came from the cache.",
+    ["model", "result"])
+semantic_cache_requests = registry.counter(
+    "semantic_cache_requests_total", "Questions looked up in the semantic cache, by whether a similar one matched.",
+    ["model", "result"])
+admission_wait = registry.histogram(
+    "admission_wait_seconds", "Time chat requests waited in a model's queue.", ["model"])
+admission_queue_depth = registry.gauge(
+    "admission_queue_depth", "Chat requests waiting for a model.", ["model"])
+admission_active = registry.gauge(
+    "admission_active_requests", "Chat requests currently generating, per model.", ["model"])
+admission_rejected = registry.counter(
+    "admission_rejected_total", "Chat requests turned away because a model's queue was full.", ["model"])
+compactions = registry.counter(
+    "conversation_compactions_total", "Background summaries of old conversation turns, by outcome.", ["result"])
+
+
+def response_stats(response):
+    """Extract Ollama's timing fields from a final chat response, durations in seconds."""
+    stats = {}
+    for field in ('total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration'):
+        value = response.get(field)
+        if value is not None:
+            stats[field] = value / NANOSECONDS
+    for field in ('prompt_eval_count', 'eval_count'):
+        value = response.get(field)
+        if value is not None:
+            stats[field] = value
+    if stats.get('eval_count') and stats.get('eval_duration'):
+        stats['eval_rate'] = stats['eval_count'] / stats['eval_duration']
+    return stats
+
+
+def observe_response(model, response, ttft=None, prompt_tokens=None):
+    """Record the timing fields of a final chat response and return them.
+
+    prompt_tokens is the estimated size of the prompt that was sent. Compared
+    with prompt_eval_count it gives the share of the prompt that Ollama took
+    from its cache instead of evaluating.
+    """
+    stats = response_stats(response)
+    if prompt_tokens and 'prompt_eval_count' in stats:
+        stats['prompt_tokens'] = prompt_tokens
+        stats['prompt_reuse'] = min(1.0, max(0.0, 1 - stats['prompt_eval_count'] / prompt_tokens))
+    histograms = {
+        'total_duration': total_duration,
+        'load_duration': load_duration,
+        'prompt_eval_count': prompt_eval_count,
+        'prompt_eval_duration': prompt_eval_duration,
+        'eval_count': eval_count,
+        'eval_duration': eval_duration,
+        'eval_rate': eval_rate,
+        'prompt_reuse': prompt_reuse,
+    }
+    for field, histogram in histograms.items():
+        if field in stats:
+            histogram.observe(stats[field], model=model)
+    if ttft is not None:
+        stats['ttft'] = ttft
+        time_to_first_token.observe(ttft, model=model)
+    return stats
+
+
+def format_stats(stats):
+    """One-line summary of a turn's timing, for the CLI."""
+    parts = []
+    if 'ttft' in stats:
+        parts.append(f"first token {stats['ttft']:.2f}s")
+    if 'prompt_eval_count' in stats:
+        reused = f", {stats['prompt_reuse']:.0%} cached" if 'prompt_reuse' in stats else ""
+        parts.append(f"prompt {stats['prompt_eval_count']} tok in {stats.get('prompt_eval_duration', 0):.2f}s{reused}")
+    if 'eval_count' in stats:
+        rate = f" at {stats['eval_rate']:.1f} tok/s" if 'eval_rate' in stats else ""
+        parts.append(f"{stats['eval_count']} tok{rate}")
+    if stats.get('load_duration'):
+        parts.append(f"load {stats['load_duration']:.2f}s")
+    if 'total_duration' in stats:
+        parts.append(f"total {stats['total_duration']:.2f}s")
+    return " · ".join(parts)
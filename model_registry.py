@@ -0,0 +1,110 @@
+import time
+import threading
+from backend_pool import pool
+
+# How long a model listing stays fresh before the hosts are listed again
+DEFAULT_TTL = 30.0
+
+
+class _Refresh:
+    """A single in-flight call to list the models, shared by concurrent callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.models = None
+        self.error = None
+
+
+class ModelRegistry:
+    """Cached view of the locally available models.
+
+    The listing is refreshed at most once per TTL, and concurrent callers that
+    find it stale share a single in-flight listing call. Call
+    invalidate() after anything that adds or removes a model.
+    """
+
+    def __init__(self, list_models=None, ttl=DEFAULT_TTL):
+        self._list_models = list_models or pool.list
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._models = None
+        self._fetched_at = 0.0
+        self._generation = 0
+        self._refresh = None
+
+    def _fetch(self):
+        """Call the backend and index the models by every name they are known by."""
+        models_response = self._list_models()
+        models = {}
+        for model in models_response['models']:
+            # Check which key contains the model name
+            for key in ('name', 'model'):
+                if key in model and model[key]:
+                    models.setdefault(model[key], model)
+        return models
+
+    def _get_models(self):
+        with self._lock:
+            if self._models is not None and time.monotonic() - self._fetched_at < self.ttl:
+                return self._models
+            refresh = self._refresh
+            leader = refresh is None
+            if leader:
+                refresh = self._refresh = _Refresh()
+                generation = self._generation
+
+        if not leader:
+            refresh.done.wait()
+            if refresh.error is not None:
+                raise refresh.error
+            return refresh.models
+
+        try:
+            refresh.models = self._fetch()
+        except Exception as e:
+            refresh.error = e
+        finally:
+            with self._lock:
+                # invalidate() may already have let a newer listing start
+                if self._refresh is refresh:
+                    self._refresh = None
+                # Don't cache a listing that was invalidated while it was in flight
+                if refresh.error is None and generation == self._generation:
+                    self._models = refresh.models
+                    self._fetched_at = time.monotonic()
+            refresh.done.set()
+
+        if refresh.error is not None:
+            raise refresh.error
+        return refresh.models
+
+    def names(self):
+        """Return the names of all available models."""
+        # Models listed under both 'name' and 'model' are only reported once
+        names = []
+        seen = set()
+        for name, model in self._get_models().items():
+            if id(model) not in seen:
+                seen.add(id(model))
+                names.append(name)
+        return names
+
+    def exists(self, model_name):
+        """Check if a model is available locally."""
+        return model_name in self._get_models()
+
+    def get(self, model_name):
+        """Return the listing entry of a model, or None if it isn't available."""
+        return self._get_models().get(model_name)
+
+    def invalidate(self):
+        """Drop the cached listing so the next lookup fetches a fresh one."""
+        with self._lock:
+            self._models = None
+            self._generation += 1
+            # Later lookups start a new listing rather than join one that began before the change
+            self._refresh = None
+
+
+# Shared registry used by both the web and the CLI front ends
+registry = ModelRegistry()
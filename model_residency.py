@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from jobs import JobRunner
+from backend_pool import pool, base_name
+
+# How long Ollama keeps a model in memory after its last request
+DEFAULT_KEEP_ALIVE = os.environ.get("OLLAMA_STUDIES_KEEP_ALIVE", "30m")
+
+# Models used within PIN_WINDOW seconds are kept loaded for longer
+PINNED_KEEP_ALIVE = os.environ.get("OLLAMA_STUDIES_PINNED_KEEP_ALIVE", "2h")
+PIN_WINDOW = 15 * 60
+
+# Custom models that aren't in active use are let go quickly
+CUSTOM_KEEP_ALIVE = os.environ.get("OLLAMA_STUDIES_CUSTOM_KEEP_ALIVE", "5m")
+
+# How long a listing of the loaded models stays fresh
+LOADED_MODELS_TTL = 5.0
+
+
+class ModelResidency:
+    """Keeps the models people are chatting with loaded in Ollama.
+
+    Models are preloaded in the background as soon as they are chosen, and
+    every request carries a keep_alive that depends on how the model is used:
+    models with recent traffic are pinned, built-in models get the default,
+    and rarely used custom models get a short keep_alive so they can be evicted.
+    """
+
+    def __init__(self, model_options=None):
+        # model_options is the front end's MODEL_OPTIONS; an entry may set its own 'keep_alive'
+        model_options = model_options or {}
+        self.known_models = {base_name(name) for name in model_options}
+        self.keep_alive_overrides = {base_name(name): options['keep_alive']
+                                     for name, options in model_options.items() if 'keep_alive' in options}
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._loaded = None
+        self._loaded_at = 0.0
+        self._preloads = JobRunner(workers=1, max_queue=8)
+
+    def touch(self, model_name):
+        """Record that a model is being used."""
+        with self._lock:
+            self._last_used[base_name(model_name)] = time.monotonic()
+
+    def is_pinned(self, model_name):
+        with self._lock:
+            last_used = self._last_used.get(base_name(model_name))
+        return last_used is not None and time.monotonic() - last_used < PIN_WINDOW
+
+    def keep_alive_for(self, model_name):
+        """Return the keep_alive to send with a request for this model."""
+        name = base_name(model_name)
+        if name in self.keep_alive_overrides:
+            return self.keep_alive_overrides[name]
+        if self.is_pinned(name):
+            return PINNED_KEEP_ALIVE
+        if name in self.known_models:
+            return DEFAULT_KEEP_ALIVE
+        return CUSTOM_KEEP_ALIVE
+
+    def loaded_models(self):
+        """Return the names of the models Ollama currently has in memory."""
+        with self._lock:
+            if self._loaded is not None and time.monotonic() - self._loaded_at < LOADED_MODELS_TTL:
+                return self._loaded
+        response = pool.ps()
+        loaded = set()
+        for model in response['models']:
+            for key in ('name', 'model'):
+                if key in model and model[key]:
+                    loaded.add(base_name(model[key]))
+        with self._lock:
+            self._loaded = loaded
+            self._loaded_at = time.monotonic()
+        return loaded
+
+    def is_loaded(self, model_name):
+        try:
+            return base_name(model_name) in self.loaded_models()
+        except Exception as e:
+            print(f"Error listing loaded models: {e}")
+            return False
+
+    def _load(self, job, model_name):
+        job.update(message=f"Loading {model_name}")
+        # A generate request without a prompt only loads the model
+        pool.generate(model=model_name, keep_alive=self.keep_alive_for(model_name))
+        with self._lock:
+            self._loaded = None
+
+    def preload(self, model_name):
+        """Load a model in the background unless it is already in memory."""
+        self.touch(model_name)
+        if self.is_loaded(model_name):
+            return None
+        try:
+            return self._preloads.submit('preload', model_name, self._load, model_name)
+        except Exception as e:
+            print(f"Error preloading {model_name}: {e}")
+            return None
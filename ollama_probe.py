@@ -0,0 +1,87 @@
+import os
+import time
+import shutil
+import socket
+import threading
+from urllib.parse import urlsplit
+from backend_pool import HOSTS
+
+# How long a probe result is reused before the binary and daemon are checked again
+PROBE_TTL = 30.0
+
+# A daemon that doesn't accept a connection by then is treated as not running
+CONNECT_TIMEOUT = 0.5
+
+DEFAULT_PORT = 11434
+
+
+def daemon_address(host):
+    """(hostname, port) of an Ollama host, with the defaults the ollama client applies to OLLAMA_HOST."""
+    scheme, _, hostport = (host or '').partition('://')
+    if not hostport:
+        scheme, hostport, default_port = 'http', host or '', DEFAULT_PORT
+    else:
+        default_port = {'http': 80, 'https': 443}.get(scheme, DEFAULT_PORT)
+    parts = urlsplit(f"{scheme}://{hostport}")
+    hostname = parts.hostname or '127.0.0.1'
+    if hostname == '0.0.0.0':
+        # The address the daemon listens on, not one to connect to
+        hostname = '127.0.0.1'
+    return hostname, parts.port or default_port
+
+
+class OllamaProbe:
+    """Whether Ollama is available, checked in-process and memoized for a TTL.
+
+    The binary is looked up on PATH and the daemon is probed with a plain TCP
+    connect, so neither forks a subprocess nor imports the ollama client.
+    Results are reused for `ttl` seconds; call invalidate() after installing
+    or starting Ollama.
+    """
+
+    def __init__(self, hosts=None, ttl=PROBE_TTL):
+        if hosts is None:
+            hosts = [host.strip() for host in HOSTS.split(",") if host.strip()] or [os.environ.get('OLLAMA_HOST')]
+        self.hosts = hosts
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def _memoized(self, name, check):
+        with self._lock:
+            cached = self._results.get(name)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl:
+                return cached[0]
+        result = check()
+        with self._lock:
+            self._results[name] = (result, time.monotonic())
+        return result
+
+    def binary_installed(self):
+        """Whether the ollama binary is on PATH."""
+        return self._memoized('binary', lambda: shutil.which('ollama') is not None)
+
+    def daemon_running(self):
+        """Whether any configured Ollama host accepts connections."""
+        def check():
+            for host in self.hosts:
+                try:
+                    with socket.create_connection(daemon_address(host), timeout=CONNECT_TIMEOUT):
+                        return True
+                except OSError:
+                    continue
+            return False
+
+        return self._memoized('daemon', check)
+
+    def is_installed(self):
+        """Whether Ollama can be used: installed here, or a daemon answering, e.g. on another machine."""
+        return self.binary_installed() or self.daemon_running()
+
+    def invalidate(self):
+        with self._lock:
+            self._results.clear()
+
+
+# Shared probe used by both the web and the CLI front ends
+probe = OllamaProbe()
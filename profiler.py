@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import platform
+import itertools
+import threading
+from statistics import median
+from backend_pool import pool, base_name, HOSTS
+
+MODEL_PROFILES = os.path.join("conversations", "model_profiles.json")
+
+# Grid the profile command runs each model across; None leaves the choice to Ollama
+DEFAULT_NUM_CTX = [2048, 4096]
+DEFAULT_NUM_BATCH = [256, 512]
+
+# Share of the machine's RAM a model may take up and still count as fitting
+RAM_HEADROOM = 0.8
+
+# Measured replies per option set, after one that loads the model with the options
+DEFAULT_RUNS = 3
+
+# The fixed workload: the same prompt and reply length for every model and option set
+PROFILE_PROMPT = ("Explain in a few paragraphs how a hash table works, "
+                  "including how collisions are handled and when it is resized.")
+PROFILE_MAX_TOKENS = 128
+
+
+def default_num_threads():
+    """Thread counts to try: Ollama's own choice, half the cores and all of them."""
+    cores = os.cpu_count() or 1
+    return [None] + sorted({max(1, cores // 2), cores})
+
+
+def total_memory():
+    """Physical memory of this machine in bytes, or None where it can't be read."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def machine_id():
+    """Key of this machine in the profile file: measurements only hold for the hardware they were taken on."""
+    memory = total_memory()
+    memory = f"{round(memory / 1024 ** 3)}GiB" if memory else "unknown-memory"
+    return f"{platform.node() or 'localhost'}/{platform.machine() or 'unknown'}/{os.cpu_count() or 1}cpu/{memory}"
+
+
+def option_grid(num_ctx=None, num_thread=None, num_batch=None):
+    """Every combination of the option values, leaving out options set to None."""
+    grid = itertools.product(num_ctx or DEFAULT_NUM_CTX, num_thread or default_num_threads(),
+                             num_batch or DEFAULT_NUM_BATCH)
+    return [{key: value for key, value in zip(('num_ctx', 'num_thread', 'num_batch'), values) if value is not None}
+            for values in grid]
+
+
+def format_options(options):
+    return " ".join(f"{key}={value}" for key, value in sorted(options.items())) or "defaults"
+
+
+class ModelProfiler:
+    """Measured throughput of the local models, persisted per machine.
+
+    profile() runs a fixed workload against a model for each option set of
+    a grid of num_ctx, num_thread and num_batch, and records tokens/s, time
+    to first token and the memory the loaded model takes up. best() then
+    picks the fastest option set whose model fits in RAM_HEADROOM of the
+    machine's memory. The file is read again when it changes, so a running
+    web app picks up a profile taken from the command line.
+    """
+
+    def __init__(self, path=MODEL_PROFILES, machine=None, chat=None, ps=None):
+        self.path = path
+        self.machine = machine or machine_id()
+        self._chat = chat or pool.chat
+        self._ps = ps or pool.ps
+        self._lock = threading.Lock()
+        self._profiles = None
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._profiles is not None and mtime == self._mtime:
+                return self._profiles
+            profiles = {}
+            if mtime is not None:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        profiles = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Error reading model profiles: {e}")
+            self._profiles = profiles
+            self._mtime = mtime
+            return profiles
+
+    def results(self, model_name):
+        """The measurements of a model on this machine, an empty list if it wasn't profiled."""
+        machine = self._load().get('machines', {}).get(self.machine, {})
+        return machine.get('models', {}).get(base_name(model_name), {}).get('results', [])
+
+    def fits(self, result, memory=None):
+        """Whether the part of a model held in RAM, rather than on the GPU, fits in this machine's memory."""
+        memory = memory if memory is not None else total_memory()
+        if not memory or result.get('memory_bytes') is None:
+            return True
+        return result['memory_bytes'] - (result.get('vram_bytes') or 0) <= memory * RAM_HEADROOM
+
+    def best(self, model_name):
+        """The fastest measured option set of a model that fits in RAM, or None."""
+        candidates = [result for result in self.results(model_name)
+                      if result.get('tokens_per_second') and self.fits(result)]
+        return max(candidates, key=lambda result: result['tokens_per_second'], default=None)
+
+    def best_options(self, model_name):
+        """Options of the fastest measured option set of a model that fits in RAM, or {}."""
+        best = self.best(model_name)
+        return dict(best['options']) if best is not None else {}
+
+    def throughput(self, model_name):
+        """Tokens/s of a model with its best options, or None if it wasn't profiled."""
+        best = self.best(model_name)
+        return best['tokens_per_second'] if best is not None else None
+
+    def fastest(self, model_names):
+        """The profiled model that generates fastest on this machine, or None if none was profiled."""
+        measured = [(self.throughput(name), name) for name in model_names]
+        measured = [(speed, name) for speed, name in measured if speed]
+        return max(measured)[1] if measured else None
+
+    def resident_memory(self, model_name):
+        """(size, size_vram) of a loaded model as Ollama reports it, or (None, None)."""
+        for model in self._ps()['models']:
+            name = model.get('model') or model.get('name')
+            if name and base_name(name) == base_name(model_name):
+                return model.get('size'), model.get('size_vram')
+        return None, None
+
+    def measure(self, model_name, options, runs=DEFAULT_RUNS):
+        """Run the workload against a model with one option set and return the measurements."""
+        options = dict(options, temperature=0, num_predict=PROFILE_MAX_TOKENS)
+        messages = [{"role": "user", "content": PROFILE_PROMPT}]
+        # Ollama reloads the model when num_ctx, num_thread or num_batch change, so load time isn't measured
+        self._chat(model=model_name, messages=messages, options=dict(options, num_predict=1))
+        memory, vram = self.resident_memory(model_name)
+
+        speeds = []
+        ttfts = []
+        for _ in range(runs):
+            ttft = None
+            tokens = 0
+            started = time.perf_counter()
+            final = {}
+            for chunk in self._chat(model=model_name, messages=messages, options=options, stream=True):
+                if chunk.get('message', {}).get('content'):
+                    tokens += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                if chunk.get('done'):
+                    final = chunk
+            elapsed = time.perf_counter() - started
+            if final.get('eval_count') and final.get('eval_duration'):
+                speeds.append(final['eval_count'] / (final['eval_duration'] / 1e9))
+            elif tokens and ttft is not None and elapsed > ttft:
+                speeds.append(tokens / (elapsed - ttft))
+            if ttft is not None:
+                ttfts.append(ttft * 1000.0)
+
+        return {
+            'options': {key: value for key, value in options.items() if key in ('num_ctx', 'num_thread', 'num_batch')},
+            'tokens_per_second': round(median(speeds), 2) if speeds else None,
+            'ttft_ms': round(median(ttfts), 1) if ttfts else None,
+            'memory_bytes': memory,
+            'vram_bytes': vram,
+            'runs': runs,
+        }
+
+    def profile(self, model_name, grid, runs=DEFAULT_RUNS, progress=None):
+        """Measure a model across the option grid and save the results, replacing earlier ones."""
+        results = []
+        for options in grid:
+            try:
+                result = self.measure(model_name, options, runs)
+            except Exception as e:
+                result = {'options': options, 'error': str(e)}
+            results.append(result)
+            if progress is not None:
+                progress(model_name, result)
+        self.save(model_name, results)
+        return results
+
+    def save(self, model_name, results):
+        with self._lock:
+            self._profiles = None
+            profiles = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as f:
+                    profiles = json.load(f)
+            machine = profiles.setdefault('machines', {}).setdefault(self.machine, {})
+            machine['cpu_count'] = os.cpu_count()
+            machine['memory_bytes'] = total_memory()
+            machine.setdefault('models', {})[base_name(model_name)] = {
+                'profiled_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'hosts': HOSTS or os.environ.get('OLLAMA_HOST') or None,
+                'results': results,
+            }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Written to the side and renamed, so readers never see half a file
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w", encoding='utf-8') as f:
+                json.dump(profiles, f, indent=2)
+            os.replace(temporary, self.path)
+
+
+# Shared profiles used by both the web and the CLI front ends
+profiler = ModelProfiler()
@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import metrics
+from backend_pool import pool
+from model_registry import registry
+
+# 'deterministic' caches only temperature 0 requests, 'always' caches every request, 'off' disables the cache
+CACHE_MODE = os.environ.get("OLLAMA_STUDIES_RESPONSE_CACHE", "deterministic")
+
+RESPONSE_CACHE_DATABASE = os.path.join("conversations", "response_cache.db")
+
+# Size of the on-disk store before the least recently used responses are evicted
+MAX_DISK_BYTES = int(os.environ.get("OLLAMA_STUDIES_RESPONSE_CACHE_MB", "64")) * 1024 * 1024
+
+MAX_MEMORY_ENTRIES = 256
+
+
+def model_digest(model_name):
+    """Digest of a model as listed by Ollama, or None if it isn't available."""
+    model = registry.get(model_name) or registry.get(f"{model_name}:latest")
+    return model.get('digest') if model is not None else None
+
+
+def cache_key(digest, messages, options):
+    """Canonical hash of everything that determines a reply."""
+    canonical = json.dumps({
+        'digest': digest,
+        'messages': [{'role': message['role'], 'content': message['content']} for message in messages],
+        'options': options or {},
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def cached_response(model, content):
+    """A final chat response carrying a cached reply."""
+    return {'model': model, 'message': {'role': 'assistant', 'content': content}, 'done': True,
+            'done_reason': 'stop', 'cached': True}
+
+
+def replay(model, content):
+    """Yield a cached reply as the chunks of a streamed chat response."""
+    for piece in re.findall(r'\s*\S+\s*|\s+', content):
+        yield {'model': model, 'message': {'role': 'assistant', 'content': piece}, 'done': False}
+    yield cached_response(model, '')
+
+
+class ResponseCache:
+    """Replies to repeated chat requests, keyed by model digest, messages and options.
+
+    Only requests with deterministic sampling (temperature 0) are cached
+    unless the cache runs in 'always' mode. Recently used replies are kept in
+    memory in front of a SQLite store whose least recently used entries are
+    evicted once it grows past max_disk_bytes. The model's digest is part of
+    the key, so re-pulling or re-creating a model never serves stale replies;
+    entries for the old digest are dropped when the new one is first cached.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_DATABASE, mode=CACHE_MODE, max_disk_bytes=MAX_DISK_BYTES,
+                 max_memory_entries=MAX_MEMORY_ENTRIES, chat=None):
+        self.mode = mode
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_entries = max_memory_entries
+        self._chat = chat or pool.chat
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._conn = None
+        self._path = path
+        self._disk_bytes = 0
+
+    def _connection(self):
+        # Opened on first use, so a disabled cache never touches the disk
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            conn.commit()
+            self._disk_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def is_cacheable(self, options):
+        if self.mode == 'off':
+            return False
+        if self.mode == 'always':
+            return True
+        return (options or {}).get('temperature') == 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            conn = self._connection()
+            row = conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, model, digest, content):
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            self._remember(key, content)
+            conn = self._connection()
+            # Replies of an earlier version of the model can never be hit again
+            stale = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE model = ? AND digest != ?",
+                                 (model, digest)).fetchone()[0]
+            if stale:
+                conn.execute("DELETE FROM responses WHERE model = ? AND digest != ?", (model, digest))
+                self._disk_bytes -= stale
+            previous = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, digest, content, size, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (key, model, digest, content, size, time.time()))
+            self._disk_bytes += size - (previous[0] if previous else 0)
+            self._evict(conn)
+            conn.commit()
+
+    def _remember(self, key, content):
+        self._memory[key] = content
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, conn):
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                evicted.append((key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def chat(self, model, messages, options=None, stream=False, **kwargs):
+        """Like pool.chat, answering repeated requests from the cache.
+
+        Cached replies come back in the same shape as live ones, streamed
+        chunk by chunk when stream=True, with 'cached' set on the final chunk.
+        """
+        digest = model_digest(model) if self.is_cacheable(options) else None
+        if digest is None:
+            return self._chat(model=model, messages=messages, options=options, stream=stream, **kwargs)
+
+        key = cache_key(digest, messages, options)
+        content = self.get(key)
+        metrics.response_cache_requests.inc(model=model, result='hit' if content is not None else 'miss')
+        if content is not None:
+            return replay(model, content) if stream else cached_response(model, content)
+
+        response = self._chat(model=model, messages=messages, options=options, stream=stream, **kwargs)
+        if not stream:
+            if response.get('done_reason') in (None, 'stop'):
+                self.put(key, model, digest, response['message']['content'])
+            return response
+        return self._record(response, key, model, digest)
+
+    async def chat_async(self, model, messages, options=None, **kwargs):
+        """Like chat(stream=True), streaming live replies with pool.chat_async.
+
+        The digest lookup may list the models over HTTP and the cache runs
+        SQLite queries, so both go to a thread rather than stalling every
+        other stream on the event loop.
+        """
+        # Only the ASGI app streams on an event loop; the CLI doesn't pay for importing asyncio
+        import asyncio
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, model_digest, model) if self.is_cacheable(options) else None
+        key = cache_key(digest, messages, options) if digest is not None else None
+        content = await loop.run_in_executor(None, self.get, key) if key is not None else None
+        if key is not None:
+            metrics.response_cache_requests.inc(model=model, result='hit' if content is not None else 'miss')
+        if content is not None:
+            for chunk in replay(model, content):
+                yield chunk
+            return
+
+        parts = []
+        async for chunk in pool.chat_async(model=model, messages=messages, options=options, **kwargs):
+            if 'message' in chunk and chunk['message'].get('content'):
+                parts.append(chunk['message']['content'])
+            if key is not None and chunk.get('done') and chunk.get('done_reason') in (None, 'stop'):
+                await loop.run_in_executor(None, self.put, key, model, digest, "".join(parts))
+            yield chunk
+
+    def _record(self, chunks, key, model, digest):
+        # Pass a live stream through, caching the reply once it completes
+        parts = []
+        for chunk in chunks:
+            if 'message' in chunk and chunk['message'].get('content'):
+                parts.append(chunk['message']['content'])
+            if chunk.get('done') and chunk.get('done_reason') in (None, 'stop'):
+                self.put(key, model, digest, "".join(parts))
+            yield chunk
+
+
+# Shared cache used by both the web and the CLI front ends
+response_cache = ResponseCache()
@@ -0,0 +1,299 @@
+import os
+import json
+import re
+import shutil
+import tempfile
+import threading
+from array import array
+import numpy as np
+import ollama
+from embedding_cache import EmbeddingCache, text_digest
+from backend_pool import pool, base_name
+
+# Model used to embed training chunks and questions
+EMBEDDING_MODEL = os.environ.get("OLLAMA_STUDIES_EMBEDDING_MODEL", "nomic-embed-text")
+
+# Chunking of training text, in characters
+CHUNK_SIZE = 800
+MIN_CHUNK_SIZE = 200
+
+# Number of texts sent to the embeddings API per request
+EMBEDDING_BATCH_SIZE = 64
+
+# Number of chunks injected into the prompt per question
+TOP_K = 4
+
+INDEX_DIRECTORY = "training_data"
+
+# Embeddings already computed, shared by training and chat-time queries
+embedding_cache = EmbeddingCache(os.path.join(INDEX_DIRECTORY, "embedding_cache"))
+
+
+def split_long(start, paragraph, max_size=CHUNK_SIZE):
+    """Yield (position, piece) pairs of a paragraph broken into pieces of at most max_size."""
+    while len(paragraph) > max_size:
+        # Break at the last sentence end or space inside the piece
+        end = max(paragraph.rfind(". ", max_size // 2, max_size), paragraph.rfind(" ", max_size // 2, max_size))
+        end = end + 1 if end != -1 else max_size
+        yield start, paragraph[:end].strip()
+        start += end
+        paragraph = paragraph[end:]
+        stripped = paragraph.lstrip()
+        start += len(paragraph) - len(stripped)
+        paragraph = stripped
+    if paragraph:
+        yield start, paragraph
+
+
+def split_paragraphs(text, max_size=CHUNK_SIZE):
+    """Yield (position, paragraph) pairs, splitting paragraphs longer than max_size."""
+    for match in re.finditer(r'[^\n]*\S[^\n]*(?:\n(?![ \t]*\n)[^\n]*)*', text):
+        paragraph = match.group().strip()
+        start = match.start() + match.group().find(paragraph[:1])
+        yield from split_long(start, paragraph, max_size)
+
+
+def chunk_paragraphs(paragraphs, chunk_size=CHUNK_SIZE, min_size=MIN_CHUNK_SIZE):
+    """Group (position, paragraph) pairs of at most chunk_size into (position, chunk) pairs.
+
+    A chunk ends after a paragraph whose hash marks a boundary (once the chunk
+    is at least min_size), or when the next paragraph would overflow
+    chunk_size. Since boundaries depend on content and not on offsets, an edit
+    only changes the chunks around it, and the rest are re-embedded from the
+    cache.
+    """
+    start = None
+    parts = []
+    size = 0
+    for position, paragraph in paragraphs:
+        if parts and size + len(paragraph) > chunk_size:
+            yield start, "\n\n".join(parts)
+            parts, size = [], 0
+        if not parts:
+            start = position
+        parts.append(paragraph)
+        size += len(paragraph) + 2
+        if size >= min_size and text_digest(paragraph)[0] % 4 == 0:
+            yield start, "\n\n".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield start, "\n\n".join(parts)
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, min_size=MIN_CHUNK_SIZE):
+    """Group the paragraphs of a text into chunks with content-defined boundaries."""
+    return chunk_paragraphs(split_paragraphs(text, chunk_size), chunk_size, min_size)
+
+
+def request_embeddings(model, texts):
+    """Embed a list of texts, batching requests where the client supports it."""
+    embeddings = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[i:i + EMBEDDING_BATCH_SIZE]
+        if hasattr(ollama.Client, 'embed'):
+            embeddings.extend(pool.embed(model=model, input=batch)['embeddings'])
+        else:
+            # Older clients only embed one prompt per request
+            embeddings.extend(pool.embeddings(model=model, prompt=text)['embedding'] for text in batch)
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL):
+    """Embed a list of texts, only sending the ones not in the cache to Ollama."""
+    return embedding_cache.get_many(model, texts, request_embeddings)
+
+
+def normalize(vectors):
+    """Scale vectors to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def write_matrix_header(f, rows, dimensions):
+    """Write the .npy header of a float32 matrix and return its size in bytes."""
+    start = f.tell()
+    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                             'fortran_order': False, 'shape': (rows, dimensions)})
+    return f.tell() - start
+
+
+def index_path(model_name):
+    # Ollama lists a model created as 'name' under 'name:latest'; both use the same index
+    return os.path.join(INDEX_DIRECTORY, f"{base_name(model_name)}.index")
+
+
+class VectorIndex:
+    """Chunk embeddings of one model's training text, stored on disk.
+
+    Embeddings live in a unit-normalized float32 matrix that is memory-mapped
+    on load. Chunk texts are kept in a JSONL file with a byte offset table, so
+    a query only reads the chunks it returns. An index is written to a
+    staging directory and swapped in whole, and a loaded index keeps its
+    chunk file open, so it goes on reading its own files while a model is
+    retrained.
+    """
+
+    def __init__(self, path, embeddings, offsets, metadata, chunks_file):
+        self.path = path
+        self.embeddings = embeddings
+        self.offsets = offsets
+        self.metadata = metadata
+        self._chunks_file = chunks_file
+        self._chunks_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, path, chunks, embeddings, metadata=None):
+        """Write an index for the given (position, text) chunks and their embeddings."""
+        return cls.write(path, [(chunks, embeddings)], metadata)
+
+    @classmethod
+    def write(cls, path, batches, metadata=None):
+        """Write an index from (chunks, embeddings) batches, holding only one batch in memory."""
+        directory, name = os.path.split(os.path.normpath(path))
+        os.makedirs(directory or ".", exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f".{name}.", dir=directory or ".")
+        try:
+            cls._write_files(staging, batches, metadata)
+            if os.path.exists(path):
+                # Directories can't be replaced in one step; the old one is only gone for a moment
+                retired = f"{staging}.old"
+                os.replace(path, retired)
+                os.replace(staging, path)
+                shutil.rmtree(retired, ignore_errors=True)
+            else:
+                os.replace(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return cls.load(path)
+
+    @staticmethod
+    def _write_files(path, batches, metadata):
+        offsets = array('q')
+        rows = 0
+        dimensions = None
+        with open(os.path.join(path, "chunks.jsonl"), 'wb') as f, \
+                open(os.path.join(path, "embeddings.npy"), 'wb') as matrix:
+            for chunks, embeddings in batches:
+                for position, text in chunks:
+                    offsets.append(f.tell())
+                    f.write(json.dumps({"position": position, "text": text}).encode('utf-8') + b"\n")
+                embeddings = normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1))
+                if dimensions is None:
+                    dimensions = embeddings.shape[1]
+                    header_size = write_matrix_header(matrix, 0, dimensions)
+                matrix.write(embeddings.tobytes())
+                rows += len(embeddings)
+            if dimensions is None:
+                dimensions = 0
+                header_size = write_matrix_header(matrix, 0, dimensions)
+            # The row count is only known now; numpy pads the header so it can grow in place
+            matrix.seek(0)
+            if write_matrix_header(matrix, rows, dimensions) != header_size:
+                raise RuntimeError("The embedding matrix header changed size")
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(path, "metadata.json"), 'w') as f:
+            json.dump(dict(metadata or {}, chunks=len(offsets)), f)
+
+    @classmethod
+    def load(cls, path):
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        offsets = np.load(os.path.join(path, "offsets.npy"))
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        return cls(path, embeddings, offsets, metadata, open(os.path.join(path, "chunks.jsonl"), 'rb'))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_chunk(self, i):
+        with self._chunks_lock:
+            self._chunks_file.seek(int(self.offsets[i]))
+            return json.loads(self._chunks_file.readline())
+
+    def search(self, query_embedding, k=TOP_K):
+        """Return the k chunks most similar to the query as (score, chunk) pairs."""
+        if len(self) == 0:
+            return []
+        query = normalize(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+        scores = self.embeddings @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.read_chunk(i)) for i in top]
+
+
+# Loaded indexes by path, reloaded when the files on disk change
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+
+
+def get_index(model_name):
+    """Return the vector index of a trained model, or None if it has none."""
+    path = index_path(model_name)
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "metadata.json"))
+    except OSError:
+        return None
+    with _loaded_indexes_lock:
+        cached = _loaded_indexes.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, VectorIndex.load(path))
+            _loaded_indexes[path] = cached
+        return cached[1]
+
+
+def embedded_batches(chunks, batch_size=EMBEDDING_BATCH_SIZE):
+    """Yield (chunks, embeddings) for consecutive batches of (position, text) chunks."""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch, embed_texts([text for position, text in batch])
+            batch = []
+    if batch:
+        yield batch, embed_texts([text for position, text in batch])
+
+
+def build_index(model_name, content, progress=None):
+    """Chunk and embed training content and store it as the model's vector index.
+
+    content is either the text itself, or an iterable of (position, text)
+    chunks that is embedded and written batch by batch as it is consumed.
+    progress(completed, total) is called after each batch; total is None
+    for an iterable, whose length isn't known up front.
+    """
+    if isinstance(content, str):
+        chunks = list(chunk_text(content))
+        total = len(chunks)
+    else:
+        chunks, total = content, None
+
+    def batches():
+        completed = 0
+        for batch, embeddings in embedded_batches(chunks):
+            yield batch, embeddings
+            completed += len(batch)
+            if progress:
+                progress(completed, total)
+
+    return VectorIndex.write(index_path(model_name), batches(), {"embedding_model": EMBEDDING_MODEL})
+
+
+def build_context_message(model_name, query, k=TOP_K):
+    """Build a system message with the training chunks most relevant to the query.
+
+    Returns None when the model has no training index.
+    """
+    index = get_index(model_name)
+    if index is None or len(index) == 0:
+        return None
+    embedding_model = index.metadata.get("embedding_model", EMBEDDING_MODEL)
+    query_embedding = embed_texts([query], model=embedding_model)[0]
+    excerpts = [chunk['text'] for score, chunk in index.search(query_embedding, k)]
+    return {
+        "role": "system",
+        "content": "Use the following excerpts from your training content to answer when they are relevant:\n\n"
+                   + "\n\n---\n\n".join(excerpts)
+    }
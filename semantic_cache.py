@@ -0,0 +1,147 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+import metrics
+from history_window import count_tokens
+from retrieval import embed_texts, normalize
+
+# Comma-separated models whose answers may be reused for similar questions, or '*' for all models
+SEMANTIC_CACHE_MODELS = os.environ.get("OLLAMA_STUDIES_SEMANTIC_CACHE_MODELS", "")
+
+# Cosine similarity above which two questions count as the same
+SIMILARITY_THRESHOLD = float(os.environ.get("OLLAMA_STUDIES_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+# How long an answer may be reused, in seconds
+ENTRY_TTL = int(os.environ.get("OLLAMA_STUDIES_SEMANTIC_CACHE_TTL", str(24 * 60 * 60)))
+
+MAX_ENTRIES_PER_MODEL = 1024
+
+# A question only stands on its own if the conversation before it is about this short, e.g. a greeting
+MAX_CONTEXT_TOKENS = 32
+
+# Send this header with the value 'bypass' to always get a fresh answer
+BYPASS_HEADER = "X-Semantic-Cache"
+
+
+def prompt_key(system_prompt):
+    """64-bit hash of a system prompt; answers are only reused under the prompt they were given with."""
+    digest = hashlib.blake2b((system_prompt or '').encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class SemanticLookup:
+    """The result of looking a question up: its embedding, and a cached answer if one matched."""
+
+    def __init__(self, question, vector, prompt, answer=None, similarity=None):
+        self.question = question
+        self.vector = vector
+        self.prompt = prompt
+        self.answer = answer
+        self.similarity = similarity
+
+
+class _ModelEntries:
+    """Answered questions of one model, as a matrix of unit-length embeddings."""
+
+    def __init__(self, dimensions, capacity):
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.answers = [None] * capacity
+        self.prompts = np.zeros(capacity, dtype=np.uint64)
+        self.created = np.zeros(capacity)
+        self.last_used = np.zeros(capacity)
+        self.size = 0
+
+    def search(self, vector, prompt, now, ttl):
+        if not self.size:
+            return None, 0.0
+        similarities = self.vectors[:self.size] @ vector
+        # Expired entries and answers given under another system prompt never match
+        similarities[now - self.created[:self.size] > ttl] = -1.0
+        similarities[self.prompts[:self.size] != np.uint64(prompt)] = -1.0
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def add(self, vector, prompt, answer, now):
+        if self.size < len(self.answers):
+            row = self.size
+            self.size += 1
+        else:
+            # Full: replace the least recently used entry
+            row = int(np.argmin(self.last_used))
+        self.vectors[row] = vector
+        self.answers[row] = answer
+        self.prompts[row] = prompt
+        self.created[row] = now
+        self.last_used[row] = now
+
+
+class SemanticCache:
+    """Reuses answers to questions that were already asked in other words.
+
+    Only models that opt in are cached, and only for questions that stand on
+    their own: the first message of a conversation, or one that follows a few
+    words of small talk. The latest user message is embedded with the
+    retrieval embedding model and compared against the questions answered
+    before under the same system prompt. An answer is reused when the cosine
+    similarity passes the threshold. Entries expire after ENTRY_TTL, and the least recently used
+    entry makes room once a model has MAX_ENTRIES_PER_MODEL of them.
+    """
+
+    def __init__(self, models=SEMANTIC_CACHE_MODELS, threshold=SIMILARITY_THRESHOLD, ttl=ENTRY_TTL,
+                 max_entries=MAX_ENTRIES_PER_MODEL, embed=None):
+        self.models = {name.strip() for name in models.split(",") if name.strip()}
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._embed = embed or embed_texts
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def is_enabled(self, model_name):
+        return '*' in self.models or model_name in self.models or model_name.split(":")[0] in self.models
+
+    def is_standalone(self, conversation_history):
+        """Whether the conversation so far is short enough to ignore when reusing an answer."""
+        return sum(count_tokens(message['content']) for message in conversation_history) <= MAX_CONTEXT_TOKENS
+
+    def lookup(self, model_name, conversation_history, question, system_prompt=None):
+        """Embed a question and look for an answer to a similar one given under the same system prompt.
+
+        conversation_history is the conversation before the question. Returns
+        None if the question can't be cached for this model, otherwise a
+        SemanticLookup whose answer is set on a hit.
+        """
+        if not self.is_enabled(model_name) or not self.is_standalone(conversation_history):
+            return None
+        vector = normalize(np.asarray(self._embed([question]), dtype=np.float32))[0]
+        prompt = prompt_key(system_prompt)
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(model_name)
+            row, similarity = entries.search(vector, prompt, now, self.ttl) if entries is not None else (None, 0.0)
+            if row is not None and similarity >= self.threshold:
+                entries.last_used[row] = now
+                metrics.semantic_cache_requests.inc(model=model_name, result='hit')
+                return SemanticLookup(question, vector, prompt, entries.answers[row], similarity)
+        metrics.semantic_cache_requests.inc(model=model_name, result='miss')
+        return SemanticLookup(question, vector, prompt)
+
+    def add(self, model_name, lookup, answer, system_prompt=None):
+        """Remember the answer to a question that missed the cache, given under system_prompt."""
+        if lookup is None or lookup.answer is not None or not answer:
+            return
+        prompt = prompt_key(system_prompt)
+        if prompt != lookup.prompt:
+            # The session's prompt changed between the lookup and the answer
+            return
+        with self._lock:
+            entries = self._entries.get(model_name)
+            if entries is None or entries.vectors.shape[1] != len(lookup.vector):
+                entries = self._entries[model_name] = _ModelEntries(len(lookup.vector), self.max_entries)
+            entries.add(lookup.vector, prompt, answer, time.time())
+
+
+# Shared cache; the web front end consults it for opted-in models
+semantic_cache = SemanticCache()